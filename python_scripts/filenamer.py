@@ -17,12 +17,14 @@ Usage:
 filenamer file.pdf
 filenamer directory
 filenamer --config config.yaml file.pdf
+filenamer --index ~/.pdf_index.db directory
 """
 
 import fitz  # PyMuPDF
 import argparse
 import ollama
 import os
+import pdf_index
 import re
 import shutil
 import subprocess
@@ -300,7 +302,8 @@ def prepare_rename_operation(original_path, new_name, config):
 def execute_rename(rename_op, config):
     """
     Execute a single rename operation with duplicate checking.
-    Returns True if successful, False otherwise.
+    Returns True if successful, False otherwise. The path the file ends up at is
+    recorded in rename_op['final_path'].
     """
     original_path = rename_op['original_path']
     new_name = rename_op['final_name']
@@ -311,6 +314,7 @@ def execute_rename(rename_op, config):
     if os.path.basename(original_path) == new_name:
         print(f"already correct: {new_name}")
         log(f"File already has correct name: {new_name}")
+        rename_op['final_path'] = original_path
         return True
 
     # Try to rename, handling potential duplicates from other files in directory
@@ -324,6 +328,7 @@ def execute_rename(rename_op, config):
 
         os.rename(original_path, new_path)
         print(f"{os.path.basename(original_path)} -> {os.path.basename(new_path)}")
+        rename_op['final_path'] = new_path
         return True
     except FileExistsError:
         # Race condition - file was created between our check and rename
@@ -332,6 +337,7 @@ def execute_rename(rename_op, config):
         try:
             os.rename(original_path, new_path)
             print(f"{os.path.basename(original_path)} -> {os.path.basename(new_path)}")
+            rename_op['final_path'] = new_path
             return True
         except Exception as e:
             print(f"Error: {e}")
@@ -340,11 +346,22 @@ def execute_rename(rename_op, config):
         print(f"Error: {e}")
         return False
 
-def process_files(file_paths, config):
+def index_renamed_file(index, rename_op):
+    """Add the text read in phase 1 to the full-text index, under the file's final path."""
+    try:
+        if index.add(rename_op['final_path'], rename_op['content']):
+            log(f"Indexed: {rename_op['final_path']}")
+        else:
+            log(f"Already indexed, path updated: {rename_op['final_path']}")
+    except Exception as e:
+        print(f"Warning: Could not index {rename_op['final_path']}: {e}")
+
+def process_files(file_paths, config, index=None):
     """
     Process all files in two phases:
     1. Generate all new filenames
     2. Check for duplicates and rename files
+    If a pdf_index.PdfIndex is given, renamed files are added to it with the text read in phase 1.
     """
     prompt = config['prompt']
     rename_operations = []
@@ -374,6 +391,7 @@ def process_files(file_paths, config):
                     return
                 rename_op = prepare_rename_operation(file_path, new_name, config)
                 if rename_op:
+                    rename_op['content'] = content
                     rename_operations.append(rename_op)
 
     if not rename_operations:
@@ -440,7 +458,8 @@ def process_files(file_paths, config):
     print(f"\nRenaming files...")
     for idx, op in enumerate(rename_operations, 1):
         print(f"Renaming {idx}/{total_renames}: ", end="")
-        execute_rename(op, config)
+        if execute_rename(op, config) and index is not None:
+            index_renamed_file(index, op)
 
 def get_all_pdfs(directory):
     pdf_files = []
@@ -463,6 +482,7 @@ def main():
     parser.add_argument("paths", nargs='+', help="The paths to the PDF files or folders containing PDF files to be renamed")
     parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose output for debugging")
     parser.add_argument("-c", "--config", help="Path to custom configuration file (YAML format)")
+    parser.add_argument("--index", metavar="DB", help="Add renamed files to this full-text index (see pdf_index.py)")
     args = parser.parse_args()
 
     # Set global verbose flag
@@ -495,7 +515,12 @@ def main():
         print("Error: No valid PDF files found to process.")
     else:
         log(f"Processing {len(all_files)} PDF file(s)")
-        process_files(all_files, config)
+        index = pdf_index.PdfIndex(args.index) if args.index else None
+        try:
+            process_files(all_files, config, index)
+        finally:
+            if index is not None:
+                index.close()
 
 if __name__ == "__main__":
     if not sys.stdin.isatty():
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+Scanner Inbox Pipeline: OCR and Rename in One Pass
+
+This script watches a scanner inbox directory, adds an OCR text layer to the pages that
+need one (pdf_ocr.py) and names each document from its text with the LLM (filenamer.py).
+Finished files are moved to an outbox. Every file is parsed once: the text found or
+recognised by the OCR stage is handed straight to the naming stage.
+
+Features:
+- Polls the inbox and only picks up files whose size has stopped changing
+- OCR stage: classifies pages and OCRs only pages without text, on a shared page pool
+- Naming stage: asks the LLM for a file name using the text from the OCR stage
+- Each stage has its own worker pool; bounded queues between the stages apply
+  backpressure, so a slow LLM holds back the OCR stage instead of piling up files
+- Renamed files are moved to the outbox under a unique name, failures to a failed directory
+
+Usage:
+    Watch an inbox until interrupted:
+    ./pdf_inbox.py --inbox ~/Scans/inbox --outbox ~/Scans/sorted
+
+    Process what is in the inbox now and exit (e.g. from cron):
+    ./pdf_inbox.py --inbox ~/Scans/inbox --outbox ~/Scans/sorted --once
+
+    Stage sizes (files OCRed at once, Tesseract pages at once, LLM requests at once):
+    ./pdf_inbox.py --inbox in --outbox out --ocr-workers 2 --jobs 8 --name-workers 1
+"""
+
+import argparse
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import filenamer
+import pdf_ocr
+
+# Seconds between two scans of the inbox
+POLL_INTERVAL = 5
+
+# Files waiting between two stages; a full queue blocks the stage before it
+QUEUE_SIZE = 4
+
+# Name of the directory (inside the inbox) that receives files that could not be processed
+FAILED_DIR_NAME = "failed"
+
+# Default worker counts per stage
+DEFAULT_OCR_WORKERS = 2
+DEFAULT_NAME_WORKERS = 1
+
+class InboxPipeline:
+    """Watcher -> OCR stage -> naming stage, connected by bounded queues."""
+
+    def __init__(self, inbox, outbox, failed_dir, ocr_config, name_config, client,
+                 ocr_workers=DEFAULT_OCR_WORKERS, name_workers=DEFAULT_NAME_WORKERS,
+                 jobs=pdf_ocr.DEFAULT_JOBS):
+        self.inbox = inbox
+        self.outbox = outbox
+        self.failed_dir = failed_dir
+        self.ocr_config = ocr_config
+        self.name_config = name_config
+        self.client = client
+        self.ocr_workers = ocr_workers
+        self.name_workers = name_workers
+        self.jobs = jobs
+        self.ocr_queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.name_queue = queue.Queue(maxsize=QUEUE_SIZE)
+        # Files handed to the pipeline and not finished yet, so polling does not queue them twice
+        self.in_flight = set()
+        # (path, size, mtime) of files that failed but could not be moved out of the inbox;
+        # they are skipped until they change
+        self.stuck = set()
+        self.lock = threading.Lock()
+        self.done_count = 0
+        self.failed_count = 0
+
+    def scan_inbox(self, last_sizes):
+        """Returns inbox PDFs whose size and mtime did not change since the last scan, leaving
+        out files that failed and could not be moved away (until they change)."""
+        ready = []
+        sizes = {}
+        with self.lock:
+            stuck = set(self.stuck)
+        for entry in os.scandir(self.inbox):
+            if not entry.is_file() or not entry.name.lower().endswith(".pdf") or entry.name.startswith("."):
+                continue
+            stat = entry.stat()
+            if (entry.path, stat.st_size, stat.st_mtime) in stuck:
+                continue
+            sizes[entry.path] = (stat.st_size, stat.st_mtime)
+            if last_sizes.get(entry.path) == sizes[entry.path]:
+                ready.append(entry.path)
+        return ready, sizes
+
+    def ocr_stage(self, page_pool):
+        """OCR worker: adds text layers where needed and passes (path, work path, text) on."""
+        while True:
+            pdf_path = self.ocr_queue.get()
+            if pdf_path is None:
+                break
+            try:
+                work_path, text = self.ocr_file(pdf_path, page_pool)
+                # Blocks while the naming stage is behind
+                self.name_queue.put((pdf_path, work_path, text))
+            except Exception as e:
+                print(f"OCR stage failed for {pdf_path}: {e}")
+                self.fail(pdf_path)
+
+    def ocr_file(self, pdf_path, page_pool):
+        """Returns the file to name (the input or its OCRed copy) and the text of all pages."""
+        document = pdf_ocr.open_backend(self.ocr_config['backend'], pdf_path)
+        try:
+            page_count = document.page_count
+            texts = {}
+            ocr_pages = []
+            for i in range(page_count):
+                if document.page_has_text(i):
+                    texts[i] = document.page_text(i)
+                else:
+                    ocr_pages.append(i)
+        finally:
+            document.close()
+
+        if not ocr_pages:
+            print(f"Text already present in: {pdf_path}")
+            return pdf_path, "\n".join(texts[i] for i in range(page_count))
+
+        print(f"OCR of {len(ocr_pages)}/{page_count} page(s) without text: {pdf_path}")
+        work_path = pdf_ocr.make_sibling_temp(pdf_path, "_ocr.pdf")
+        if not pdf_ocr.add_ocr_to_pdf(pdf_path, work_path, config=self.ocr_config, page_pool=page_pool,
+                                      ocr_pages=ocr_pages, page_texts=texts):
+            os.remove(work_path)
+            raise RuntimeError("OCR failed")
+        return work_path, "\n".join(texts[i] for i in range(page_count))
+
+    def name_stage(self):
+        """Naming worker: asks the LLM for a name and moves the file to the outbox."""
+        while True:
+            item = self.name_queue.get()
+            if item is None:
+                break
+            pdf_path, work_path, text = item
+            try:
+                self.name_file(pdf_path, work_path, text)
+            except Exception as e:
+                print(f"Naming stage failed for {pdf_path}: {e}")
+                if work_path != pdf_path and os.path.exists(work_path):
+                    os.remove(work_path)
+                self.fail(pdf_path)
+
+    def name_file(self, pdf_path, work_path, text):
+        if not text.strip():
+            raise RuntimeError("no text found, even after OCR")
+        new_name = filenamer.get_new_filename(self.client, self.name_config['prompt'], text, self.name_config)
+        rename_op = filenamer.prepare_rename_operation(pdf_path, new_name, self.name_config)
+        if rename_op is None:
+            raise RuntimeError(f"invalid file name from the LLM: {new_name}")
+
+        # Pick the unique name and move while holding the lock, so two workers never collide
+        with self.lock:
+            final_name = filenamer.generate_unique_filename(self.outbox, rename_op['new_name'], self.name_config)
+            target_path = os.path.join(self.outbox, final_name)
+            shutil.move(work_path, target_path)
+            if work_path != pdf_path:
+                os.remove(pdf_path)
+            self.in_flight.discard(pdf_path)
+            self.done_count += 1
+        print(f"{os.path.basename(pdf_path)} -> {target_path}")
+
+    def fail(self, pdf_path):
+        """Moves a file that could not be processed out of the inbox."""
+        with self.lock:
+            try:
+                os.makedirs(self.failed_dir, exist_ok=True)
+                target_name = filenamer.generate_unique_filename(self.failed_dir, os.path.basename(pdf_path),
+                                                                 self.name_config)
+                shutil.move(pdf_path, os.path.join(self.failed_dir, target_name))
+            except OSError as e:
+                print(f"Could not move {pdf_path} to {self.failed_dir}, skipping it until it changes: {e}")
+                try:
+                    stat = os.stat(pdf_path)
+                    self.stuck.add((pdf_path, stat.st_size, stat.st_mtime))
+                except OSError:
+                    pass
+            self.in_flight.discard(pdf_path)
+            self.failed_count += 1
+
+    def run(self, once=False, poll_interval=POLL_INTERVAL):
+        """Watches the inbox (until interrupted, or until it is empty with `once`)."""
+        with ThreadPoolExecutor(max_workers=self.jobs) as page_pool:
+            ocr_threads = [threading.Thread(target=self.ocr_stage, args=(page_pool,), daemon=True)
+                           for _ in range(self.ocr_workers)]
+            name_threads = [threading.Thread(target=self.name_stage, daemon=True)
+                            for _ in range(self.name_workers)]
+            for thread in ocr_threads + name_threads:
+                thread.start()
+
+            print(f"Watching {self.inbox} (outbox: {self.outbox})")
+            last_sizes = {}
+            try:
+                while True:
+                    ready, last_sizes = self.scan_inbox(last_sizes)
+                    for pdf_path in ready:
+                        with self.lock:
+                            if pdf_path in self.in_flight:
+                                continue
+                            self.in_flight.add(pdf_path)
+                        # Blocks while the OCR stage is behind
+                        self.ocr_queue.put(pdf_path)
+                    with self.lock:
+                        idle = not self.in_flight
+                    if once and idle and len(ready) == len(last_sizes):
+                        break
+                    time.sleep(poll_interval)
+            except KeyboardInterrupt:
+                print("\nStopping after the files in progress...")
+
+            # Drain the stages in order: no more files for OCR, then no more names
+            for _ in ocr_threads:
+                self.ocr_queue.put(None)
+            for thread in ocr_threads:
+                thread.join()
+            for _ in name_threads:
+                self.name_queue.put(None)
+            for thread in name_threads:
+                thread.join()
+
+        print(f"\nSummary:")
+        print(f"  Moved to outbox: {self.done_count}")
+        print(f"  Failed: {self.failed_count}")
+
+def main():
+    parser = argparse.ArgumentParser(description='OCR and rename scanned PDFs from an inbox into an outbox')
+    parser.add_argument('--inbox', required=True, help='Directory the scanner writes PDFs to')
+    parser.add_argument('--outbox', required=True, help='Directory that receives the renamed PDFs')
+    parser.add_argument('--failed', help=f'Directory for files that could not be processed '
+                                         f'(default: {FAILED_DIR_NAME}/ in the inbox)')
+    parser.add_argument('--once', action='store_true',
+                        help='Process the files currently in the inbox, then exit')
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL,
+                        help=f'Seconds between inbox scans (default: {POLL_INTERVAL})')
+    parser.add_argument('--ocr-workers', type=int, default=DEFAULT_OCR_WORKERS,
+                        help=f'Files OCRed at once (default: {DEFAULT_OCR_WORKERS})')
+    parser.add_argument('--jobs', type=int, default=pdf_ocr.DEFAULT_JOBS,
+                        help=f'Pages OCRed at once across all files (default: {pdf_ocr.DEFAULT_JOBS})')
+    parser.add_argument('--name-workers', type=int, default=DEFAULT_NAME_WORKERS,
+                        help=f'LLM naming requests at once (default: {DEFAULT_NAME_WORKERS})')
+    parser.add_argument('--layer', choices=pdf_ocr.LAYER_MODES, default='hocr',
+                        help="How OCR text is added, see pdf_ocr.py --layer (default: hocr)")
+    parser.add_argument('--backend', choices=pdf_ocr.BACKENDS, default=pdf_ocr.DEFAULT_BACKEND,
+                        help=f'pdf_ocr.py backend (default: {pdf_ocr.DEFAULT_BACKEND})')
+    parser.add_argument('-c', '--config', help='filenamer configuration file (YAML format)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose output of the naming stage')
+    args = parser.parse_args()
+
+    if args.ocr_workers < 1 or args.name_workers < 1 or args.jobs < 1:
+        parser.error("--ocr-workers, --name-workers and --jobs must be at least 1")
+    for directory in (args.inbox, args.outbox):
+        if not os.path.isdir(directory):
+            print(f"The specified directory does not exist: {directory}")
+            sys.exit(1)
+
+    filenamer.VERBOSE = args.verbose
+    name_config = filenamer.load_config(args.config)
+    try:
+        client = filenamer.ensure_ollama_ready(name_config)
+    except RuntimeError as e:
+        print(f"Cannot name files: {e}")
+        sys.exit(1)
+
+    ocr_config = dict(pdf_ocr.DEFAULT_CONFIG, layer=args.layer, backend=args.backend)
+    pipeline = InboxPipeline(args.inbox, args.outbox, args.failed or os.path.join(args.inbox, FAILED_DIR_NAME),
+                             ocr_config, name_config, client, ocr_workers=args.ocr_workers,
+                             name_workers=args.name_workers, jobs=args.jobs)
+    pipeline.run(once=args.once, poll_interval=args.poll_interval)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+Full-Text Index of PDF Documents (SQLite FTS5)
+
+This script keeps a full-text index of PDF documents in a single SQLite file and searches it.
+pdf_ocr.py and filenamer.py feed the index with the text they extract anyway (--index DB),
+so documents are indexed without being parsed again.
+
+Features:
+- Documents are keyed by the SHA-256 hash of their content: renaming or moving a file only
+  updates its path, and identical copies are stored once
+- Incremental: files whose path, size and mtime are already known are not hashed again
+- Ranked search (BM25) with highlighted snippets, answering in milliseconds
+- Can also index existing files and directories itself, and prune deleted files
+
+Usage:
+    Search (all words must match, a trailing * matches prefixes):
+    ./pdf_index.py search vodafone rechnung 2025-03
+    ./pdf_index.py --db ~/documents.db search "kontoausz*" --limit 5
+
+    Index existing files, forget files that no longer exist, show statistics:
+    ./pdf_index.py add ~/Documents/Scans
+    ./pdf_index.py prune
+    ./pdf_index.py stats
+
+    Feed the index while processing:
+    ./pdf_ocr.py --dir ~/Documents/Scans --index ~/.pdf_index.db
+    filenamer --index ~/.pdf_index.db ~/Documents/Scans
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+# Default index file
+DEFAULT_DB = os.path.expanduser("~/.pdf_index.db")
+
+# Read size for hashing files
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Results shown by the search command, and words of context around matches in snippets
+DEFAULT_LIMIT = 20
+SNIPPET_WORDS = 12
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_path ON documents (path);
+CREATE VIRTUAL TABLE IF NOT EXISTS document_text USING fts5 (
+    text,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+def file_hash(path):
+    """Returns the SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def build_match_query(words):
+    """Turns search words into an FTS5 query: every word must match, `word*` matches prefixes.
+
+    Words are quoted, so characters such as '-' or ':' in dates and numbers are not
+    read as query syntax.
+    """
+    terms = []
+    for word in words:
+        prefix = word.endswith('*')
+        word = word.rstrip('*')
+        if word:
+            terms.append('"' + word.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return " ".join(terms)
+
+class PdfIndex:
+    """Full-text index of documents, keyed by content hash. Safe to share between threads."""
+
+    def __init__(self, path=DEFAULT_DB):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def is_current(self, pdf_path):
+        """True if the file is indexed under this path with its current size and mtime."""
+        stat = os.stat(pdf_path)
+        with self.lock:
+            row = self.db.execute("SELECT 1 FROM documents WHERE path = ? AND size = ? AND mtime = ?",
+                                  (os.path.abspath(pdf_path), stat.st_size, stat.st_mtime)).fetchone()
+        return row is not None
+
+    def add(self, pdf_path, text):
+        """Indexes the text of a file. Returns True if the text was (re-)indexed, False if the
+        content was known already and only its path was updated (e.g. after a rename).
+        
+        `text` may be a callable that returns the text. The file is hashed first, and the
+        callable is only called for new content, so moved files are not parsed again.
+        """
+        path = os.path.abspath(pdf_path)
+        stat = os.stat(path)
+        content_hash = file_hash(path)
+        with self.lock, self.db:
+            if self._move_known(content_hash, path, stat):
+                return False
+        if callable(text):
+            text = text()
+        with self.lock, self.db:
+            # Another thread may have added the same content meanwhile
+            if self._move_known(content_hash, path, stat):
+                return False
+
+            # The path now holds new content (e.g. after OCR), so its old entry is stale
+            self._forget_path(path)
+            cursor = self.db.execute(
+                "INSERT INTO documents (hash, path, size, mtime, indexed_at) VALUES (?, ?, ?, ?, ?)",
+                (content_hash, path, stat.st_size, stat.st_mtime, time.time()))
+            self.db.execute("INSERT INTO document_text (rowid, text) VALUES (?, ?)", (cursor.lastrowid, text))
+            return True
+
+    def _move_known(self, content_hash, path, stat):
+        """If the content is indexed, points its entry to `path` and returns True."""
+        row = self.db.execute("SELECT id FROM documents WHERE hash = ?", (content_hash,)).fetchone()
+        if row is None:
+            return False
+        self.db.execute("UPDATE documents SET path = ?, size = ?, mtime = ? WHERE id = ?",
+                        (path, stat.st_size, stat.st_mtime, row[0]))
+        self._forget_path(path, keep_id=row[0])
+        return True
+
+    def _forget_path(self, path, keep_id=None):
+        rows = self.db.execute("SELECT id FROM documents WHERE path = ? AND id IS NOT ?", (path, keep_id)).fetchall()
+        for (document_id,) in rows:
+            self.db.execute("DELETE FROM document_text WHERE rowid = ?", (document_id,))
+            self.db.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+
+    def prune(self):
+        """Removes documents whose file no longer exists. Returns the number removed."""
+        with self.lock:
+            rows = self.db.execute("SELECT id, path FROM documents").fetchall()
+        missing = [(document_id,) for document_id, path in rows if not os.path.exists(path)]
+        with self.lock, self.db:
+            self.db.executemany("DELETE FROM document_text WHERE rowid = ?", missing)
+            self.db.executemany("DELETE FROM documents WHERE id = ?", missing)
+        return len(missing)
+
+    def search(self, words, limit=DEFAULT_LIMIT):
+        """Returns (path, snippet) of the best matches, best first."""
+        query = build_match_query(words)
+        if not query:
+            return []
+        with self.lock:
+            return self.db.execute(
+                "SELECT documents.path, snippet(document_text, 0, '[', ']', ' ... ', ?) "
+                "FROM document_text JOIN documents ON documents.id = document_text.rowid "
+                "WHERE document_text MATCH ? ORDER BY rank LIMIT ?",
+                (SNIPPET_WORDS, query, limit)).fetchall()
+
+    def stats(self):
+        with self.lock:
+            count, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM documents").fetchone()
+        return count, size
+
+def extract_text(pdf_path):
+    """Returns the text of all pages of a PDF."""
+    import fitz  # PyMuPDF, only needed when this script indexes files itself
+    with fitz.open(pdf_path) as doc:
+        return "\n".join(page.get_text() for page in doc)
+
+def index_paths(index, paths):
+    """Indexes PDF files and directories (recursively), skipping files that are up to date."""
+    added = renamed = current = failed = 0
+    pdf_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                pdf_paths.extend(os.path.join(root, file) for file in files if file.lower().endswith(".pdf"))
+        elif path.lower().endswith(".pdf"):
+            pdf_paths.append(path)
+
+    for pdf_path in pdf_paths:
+        try:
+            if index.is_current(pdf_path):
+                current += 1
+            elif index.add(pdf_path, lambda: extract_text(pdf_path)):
+                added += 1
+            else:
+                renamed += 1
+        except Exception as e:
+            print(f"Could not index {pdf_path}: {e}")
+            failed += 1
+    print(f"Indexed {added} new, updated {renamed} moved, {current} up to date, {failed} failed")
+
+def main():
+    parser = argparse.ArgumentParser(description='Full-text index of PDF documents')
+    parser.add_argument('--db', default=DEFAULT_DB, help=f'Index file (default: {DEFAULT_DB})')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    search = subparsers.add_parser('search', help='Search the index')
+    search.add_argument('words', nargs='+', help='Words that must all occur; word* matches prefixes')
+    search.add_argument('--limit', type=int, default=DEFAULT_LIMIT,
+                        help=f'Maximum number of results (default: {DEFAULT_LIMIT})')
+    add = subparsers.add_parser('add', help='Index PDF files or directories (recursively)')
+    add.add_argument('paths', nargs='+', help='PDF files or directories')
+    subparsers.add_parser('prune', help='Remove documents whose file no longer exists')
+    subparsers.add_parser('stats', help='Show the number of indexed documents')
+    args = parser.parse_args()
+
+    index = PdfIndex(args.db)
+    try:
+        if args.command == 'search':
+            start = time.monotonic()
+            results = index.search(args.words, args.limit)
+            elapsed = time.monotonic() - start
+            for path, snippet in results:
+                print(path)
+                print(f"    {' '.join(snippet.split())}")
+            print(f"{len(results)} result(s) in {elapsed * 1000:.1f} ms")
+        elif args.command == 'add':
+            index_paths(index, args.paths)
+        elif args.command == 'prune':
+            print(f"Removed {index.prune()} document(s) whose file no longer exists")
+        else:
+            count, size = index.stats()
+            print(f"{count} document(s), {size / (1024 * 1024):.1f} MB of PDFs indexed in {args.db}")
+    finally:
+        index.close()
+
+if __name__ == "__main__":
+    main()
@@ -4,14 +4,25 @@
 """
 Combined PDF OCR Script
 
-This script adds OCR text layer to PDF files that don't have embedded text.
+This script adds OCR text layer to the pages of PDF files that don't have embedded text.
 It can process individual files or recursively scan directories.
 
 Features:
-- Uses Tesseract for OCR via pytesseract
+- Uses Tesseract for OCR via pytesseract, or via a persistent tesserocr engine per worker
+- PyMuPDF backend for text detection, rendering and writing (default), or PyPDF2 + pdf2image
+- Adds the text either by merging Tesseract's PDF or by writing word boxes into the page
 - Can check if PDFs already have text without modifying them
-- Option to repair damaged PDFs using Ghostscript
+- Fast text detection via page fonts and text operators, cached in a manifest
+- Classifies each page: only pages without a text layer are OCRed, others are copied as-is
+- Detects blank pages (separator sheets, empty duplex backs) with NumPy and skips their OCR
+- Optional cache of word layers by perceptual page hash, so repeated pages are OCRed once
+- Optional NumPy preprocessing (deskew, adaptive binarisation, despeckle) before OCR
+- Option to repair damaged PDFs: xref rebuild in-process first, Ghostscript as a fallback
 - Supports single file or recursive directory processing
+- Optionally feeds the text of processed files into a full-text index (pdf_index.py)
+- Rasterises pages in small windows, so memory stays bounded for long scans
+- OCRs scanned pages from their embedded image at native resolution, no rendering
+- OCRs pages and files in parallel, largest files first, with progress and ETA
 
 Usage:
     Single file:
@@ -19,173 +30,1462 @@ Usage:
 
     Directory (recursive):
     ./pdf_ocr_combined.py --dir /path/to/directory [--check-only] [--repair]
+
+    Rasterisation window (pages rendered at once, default 4):
+    ./pdf_ocr_combined.py --input input.pdf --window 2
+
+    Write hOCR word boxes directly into the pages instead of merging PDF pages:
+    ./pdf_ocr_combined.py --input input.pdf --layer hocr
+
+    Reuse the words of pages seen before (exact or near-exact bitmap match):
+    ./pdf_ocr_combined.py --dir /path/to/directory --layer hocr --page-cache ocr_pages.json
+
+    Clean up grey or skewed phone scans before OCR, or measure whether it helps:
+    ./pdf_ocr_combined.py --input input.pdf --preprocess
+    ./pdf_ocr_combined.py --input input.pdf --benchmark-preprocess
+
+    Use the PyPDF2/pdf2image stack instead of PyMuPDF, or compare the two:
+    ./pdf_ocr_combined.py --input input.pdf --backend pypdf
+    ./pdf_ocr_combined.py --input input.pdf --benchmark-backends
+
+    Parallelism (page workers shared by all files, files processed at once):
+    ./pdf_ocr_combined.py --dir /path/to/directory --jobs 8 [--file-jobs 3]
+
+    Text detection results are cached in .pdf_ocr_manifest.json in the scanned
+    directory (keyed by path, size and mtime), so repeated scans are cheap:
+    ./pdf_ocr_combined.py --dir /path/to/directory --check-only [--manifest FILE | --no-manifest]
 """
 
+import io
+import json
+import math
 import os
+import re
+import shutil
 import sys
 import argparse
 import subprocess
-from PyPDF2 import PdfWriter, PdfReader
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PyPDF2 import PdfWriter, PdfReader, Transformation
 from PyPDF2.errors import PdfReadError
+from PyPDF2.generic import ArrayObject, DecodedStreamObject, DictionaryObject, NameObject
 from pdf2image import convert_from_path
+import fitz  # PyMuPDF
+import numpy as np
+import pdf_index
 import pytesseract
 from PIL import Image
 
-def has_embedded_text(pdf_path):
-    """Checks if a PDF file contains embedded text."""
-    try:
-        reader = PdfReader(pdf_path)
-        if reader.is_encrypted:
+# Optional: Tesseract C API bindings, which keep the engine and language model loaded
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# Resolution used to rasterise pages for OCR
+OCR_DPI = 300
+
+# Number of pages rasterised at once. A 300 DPI A4 page is ~25 MB of RGB,
+# so peak memory is bounded by the window instead of the page count.
+PAGE_WINDOW = 4
+
+# How the OCR result is added to a page:
+#   pdf  - Tesseract renders a PDF page, which is scaled and merged onto the original
+#   hocr - Tesseract returns word boxes, written as invisible text into the page's content stream
+LAYER_MODES = ('pdf', 'hocr')
+
+# OCR engines for word boxes:
+#   tesserocr   - one persistent Tesseract engine per worker thread (C API bindings)
+#   pytesseract - a new tesseract process per page, which reloads the model every time
+# Tesseract's PDF output (--layer pdf) is always produced via pytesseract.
+ENGINES = ('tesserocr', 'pytesseract')
+DEFAULT_ENGINE = 'tesserocr' if tesserocr is not None else 'pytesseract'
+
+# Libraries used to detect text, load page images and write the OCR layer:
+#   pymupdf - PyMuPDF, everything in-process (default)
+#   pypdf   - PyPDF2 for reading and writing, pdf2image (poppler subprocesses) for rendering
+BACKENDS = ('pymupdf', 'pypdf')
+DEFAULT_BACKEND = 'pymupdf'
+
+# Errors that mean the PDF itself is damaged; only these are worth a repair (--repair).
+# Others, such as a missing tesseract binary, would fail the same way on a repaired file.
+PDF_PARSE_ERRORS = (PdfReadError, fitz.FileDataError, fitz.mupdf.FzErrorFormat, fitz.mupdf.FzErrorSyntax,
+                    IndexError, KeyError, zlib.error)
+
+# Base-14 font of the hocr text layer (Helvetica, referenced by name and not embedded)
+MUPDF_TEXT_FONT = "helv"
+
+# Font resource name and approximate average glyph width (in em) of the hocr text layer
+TEXT_LAYER_FONT = "/OcrText"
+TEXT_LAYER_CHAR_WIDTH = 0.5
+
+# Tolerance (fraction of the page size) for an image to count as covering the full page
+FULL_PAGE_TOLERANCE = 0.01
+
+# PIL modes for uncompressed/Flate image XObjects, by (ColorSpace, BitsPerComponent)
+RAW_IMAGE_MODES = {
+    ("/DeviceGray", 1): "1",
+    ("/DeviceGray", 8): "L",
+    ("/DeviceRGB", 8): "RGB",
+}
+
+# Device space to use for /ICCBased color spaces, by number of components
+ICC_COLOR_SPACES = {1: "/DeviceGray", 3: "/DeviceRGB"}
+
+NUMBER_RE = re.compile(rb"[-+]?(?:\d+\.?\d*|\.\d+)")
+
+# Text-showing operators (Tj, TJ, ', ") directly after a string or array operand
+TEXT_OPERATOR_RE = re.compile(rb"[)\]>]\s*(?:Tj|TJ|'|\")")
+
+# How deep to follow nested form XObjects when looking for text
+MAX_FORM_DEPTH = 3
+
+# Page-level OCR workers shared by all files (each runs one Tesseract process)
+DEFAULT_JOBS = os.cpu_count() or 1
+
+# Seconds between progress reports in directory mode
+PROGRESS_INTERVAL = 5
+
+# Default manifest file, created in the root of a processed directory
+MANIFEST_NAME = ".pdf_ocr_manifest.json"
+
+# Blank page detection on a downsampled copy of each page (~BLANK_SAMPLE_WIDTH pixels wide).
+# A page is blank if less than BLANK_INK_THRESHOLD of its area is at least
+# BLANK_INK_CONTRAST grey levels darker than the paper, or if its grey-level standard
+# deviation is below BLANK_STDDEV_THRESHOLD. BLANK_MARGIN of each edge is ignored.
+BLANK_SAMPLE_WIDTH = 200
+BLANK_MARGIN = 0.05
+BLANK_INK_CONTRAST = 64
+BLANK_INK_THRESHOLD = 0.001
+BLANK_STDDEV_THRESHOLD = 2.0
+
+# Optional preprocessing before OCR (--preprocess). Binarisation compares each pixel with
+# the mean of a window 1/BINARIZE_WINDOW_FRACTION of the page wide; deskew searches
+# +-DESKEW_MAX_ANGLE degrees in DESKEW_STEP steps on a DESKEW_SAMPLE_WIDTH pixel copy.
+BINARIZE_WINDOW_FRACTION = 40
+BINARIZE_SENSITIVITY = 0.15
+DESKEW_MAX_ANGLE = 5
+DESKEW_STEP = 0.1
+DESKEW_SAMPLE_WIDTH = 800
+
+# Page cache (--page-cache): pages are hashed on a PAGE_HASH_SIZE grid, with one bit per
+# direction for every pair of neighbouring cells whose grey levels differ by more than
+# PAGE_HASH_MIN_GRADIENT (flat paper hashes to zeros, so scan noise does not flip bits).
+# Pages whose hashes differ in at most PAGE_CACHE_MAX_DISTANCE of the bits set in either hash
+# reuse the cached words (mostly white pages set few bits, so a fixed bit count would match
+# different pages); the PAGE_CACHE_MAX_ENTRIES most recently used pages are kept on disk.
+PAGE_HASH_SIZE = 64
+PAGE_HASH_MIN_GRADIENT = 8
+PAGE_CACHE_MAX_DISTANCE = 0.02
+PAGE_CACHE_MAX_ENTRIES = 5000
+
+# Number of set bits of every byte value, for Hamming distances between page hashes
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint16)
+
+# Number of pages compared by --benchmark-preprocess
+BENCHMARK_PAGES = 10
+
+# Default OCR settings, overridden from the command line
+DEFAULT_CONFIG = {
+    'window': PAGE_WINDOW,
+    'layer': 'pdf',
+    'blank_threshold': BLANK_INK_THRESHOLD,
+    'preprocess': False,
+    'engine': DEFAULT_ENGINE,
+    'backend': DEFAULT_BACKEND,
+}
+
+# Persistent tesserocr engines, one per worker thread
+_engines = threading.local()
+
+# MuPDF is not thread-safe: every PyMuPDF call made by file workers goes through this lock
+MUPDF_LOCK = threading.Lock()
+
+# Guards run-wide counters (see add_ocr_to_pdf's `stats`) shared by file workers
+STATS_LOCK = threading.Lock()
+
+def make_sibling_temp(path, suffix):
+    """Creates a unique temp file next to `path`, so concurrent runs never share a name."""
+    directory, base_name = os.path.split(path)
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.splitext(base_name)[0]}_",
+                                     suffix=suffix, dir=directory or ".")
+    os.close(fd)
+    # mkstemp creates 0600 files; keep the original's permissions once the temp replaces it
+    if os.path.exists(path):
+        shutil.copymode(path, temp_path)
+    return temp_path
+
+class TextManifest:
+    """Caches per-page text-layer detection results, keyed by path and validated by size and mtime.
+    
+    Each entry stores the page classification as a string with one '1' (has text, or was
+    found blank during OCR) or '0' (needs OCR) per page.
+    """
+
+    def __init__(self, path=None):
+        # path=None keeps the manifest in memory only
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
             try:
-                reader.decrypt('')
-            except:
-                print(f"The file is encrypted and cannot be read: {pdf_path}")
-                return True  # Skip this file
-        for page in reader.pages:
-            if page.extract_text().strip():
-                return True
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Warning: Could not load manifest {path}: {e}")
+
+    def get(self, pdf_path):
+        """Returns the cached result, or None if the file is unknown or has changed."""
+        entry = self.entries.get(os.path.abspath(pdf_path))
+        if entry is None:
+            return None
+        stat = os.stat(pdf_path)
+        if entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime or 'text_pages' not in entry:
+            return None
+        return [flag == '1' for flag in entry['text_pages']]
+
+    def put(self, pdf_path, text_pages):
+        stat = os.stat(pdf_path)
+        with self.lock:
+            self.entries[os.path.abspath(pdf_path)] = {
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'text_pages': ''.join('1' if has_text else '0' for has_text in text_pages),
+            }
+            self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.path or not self.dirty:
+                return
+            temp_path = make_sibling_temp(self.path, ".json")
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f)
+            os.replace(temp_path, self.path)
+            self.dirty = False
+
+def page_hash(image):
+    """Returns a perceptual (difference) hash of the page bitmap as bytes; see PAGE_HASH_SIZE."""
+    gray = image.convert('L').resize((PAGE_HASH_SIZE + 1, PAGE_HASH_SIZE), Image.Resampling.BOX)
+    cells = np.asarray(gray, dtype=np.int16)
+    gradient = cells[:, 1:] - cells[:, :-1]
+    bits = np.concatenate([gradient > PAGE_HASH_MIN_GRADIENT, gradient < -PAGE_HASH_MIN_GRADIENT])
+    return np.packbits(bits).tobytes()
+
+class PageCache:
+    """Caches OCR word layers by the perceptual hash of the page bitmap.
+    
+    Repeated pages (cover sheets, letterheads, standard terms) are recognised once; later
+    occurrences reuse the words of an exact or near-exact match. Entries store the words
+    and when they were last used, so the cache file keeps the most recently used pages.
+    """
+
+    def __init__(self, path=None, max_distance=PAGE_CACHE_MAX_DISTANCE):
+        # path=None keeps the cache in memory only
+        self.path = path
+        self.max_distance = max_distance
+        self.entries = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Warning: Could not load page cache {path}: {e}")
+        
+        # All hashes as rows of one array for the near-match search, grown by doubling
+        self.keys = list(self.entries)
+        self.hashes = np.zeros((max(len(self.keys), 64), PAGE_HASH_SIZE * PAGE_HASH_SIZE // 4), dtype=np.uint8)
+        for row, key in enumerate(self.keys):
+            self.hashes[row] = np.frombuffer(bytes.fromhex(key), dtype=np.uint8)
+
+    def get(self, key):
+        """Returns the cached words for the page hash `key`, or None on a miss."""
+        with self.lock:
+            entry = self.entries.get(key.hex())
+            if entry is not None:
+                self.hits += 1
+            elif self.max_distance and self.keys:
+                hashes = self.hashes[:len(self.keys)]
+                key_bits = np.frombuffer(key, dtype=np.uint8)
+                differing = POPCOUNT[hashes ^ key_bits].sum(axis=1)
+                distances = differing / np.maximum(POPCOUNT[hashes | key_bits].sum(axis=1), 1)
+                best = int(distances.argmin())
+                if distances[best] <= self.max_distance:
+                    entry = self.entries[self.keys[best]]
+                    self.hits += 1
+                    self.near_hits += 1
+            if entry is None:
+                self.misses += 1
+                return None
+            entry['used'] = time.time()
+            self.dirty = True
+            return [tuple(word) for word in entry['words']]
+
+    def put(self, key, words):
+        with self.lock:
+            hex_key = key.hex()
+            if hex_key not in self.entries:
+                if len(self.keys) == len(self.hashes):
+                    self.hashes = np.concatenate([self.hashes, np.zeros_like(self.hashes)])
+                self.hashes[len(self.keys)] = np.frombuffer(key, dtype=np.uint8)
+                self.keys.append(hex_key)
+            self.entries[hex_key] = {'words': [list(word) for word in words], 'used': time.time()}
+            self.dirty = True
+
+    def report(self):
+        lookups = self.hits + self.misses
+        if lookups:
+            print(f"Page cache: {self.hits}/{lookups} hits ({self.hits / lookups:.1%}), "
+                  f"{self.near_hits} near matches, {len(self.entries)} cached pages")
+
+    def save(self):
+        with self.lock:
+            if not self.path or not self.dirty:
+                return
+            recent = sorted(self.entries.items(), key=lambda item: item[1]['used'], reverse=True)
+            temp_path = make_sibling_temp(self.path, ".json")
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(dict(recent[:PAGE_CACHE_MAX_ENTRIES]), f)
+            os.replace(temp_path, self.path)
+            self.dirty = False
+
+def _stream_data(contents):
+    """Returns the decoded bytes of a /Contents entry (single stream or array of streams)."""
+    contents = contents.get_object()
+    if isinstance(contents, ArrayObject):
+        return b"\n".join(part.get_object().get_data() for part in contents)
+    return contents.get_data()
+
+def _shows_text(resources, contents, depth=0):
+    """True if the resources declare fonts and the content stream shows text."""
+    if resources is None:
         return False
+    resources = resources.get_object()
+    if resources.get("/Font") and contents is not None:
+        if TEXT_OPERATOR_RE.search(_stream_data(contents)):
+            return True
+    # Text may also live in form XObjects drawn by the page
+    if depth < MAX_FORM_DEPTH:
+        xobjects = resources.get("/XObject")
+        for xobject in (xobjects.get_object().values() if xobjects else []):
+            xobject = xobject.get_object()
+            if xobject.get("/Subtype") == "/Form" and _shows_text(xobject.get("/Resources"), xobject, depth + 1):
+                return True
+    return False
+
+def page_has_text(page):
+    """Checks a single page for a text layer by inspecting fonts and text operators."""
+    return _shows_text(page.get("/Resources"), page.get("/Contents"))
+
+def classify_pages(pdf_path, manifest=None, backend=DEFAULT_BACKEND):
+    """Returns one bool per page, True where the page already has a text layer.
+    
+    Returns an empty list for encrypted files that cannot be opened (nothing to OCR),
+    and None if the file cannot be read at all.
+    """
+    if manifest is not None:
+        cached = manifest.get(pdf_path)
+        if cached is not None:
+            return cached
+    try:
+        document = open_backend(backend, pdf_path)
+        try:
+            text_pages = [document.page_has_text(i) for i in range(document.page_count)]
+        finally:
+            document.close()
+        if manifest is not None:
+            manifest.put(pdf_path, text_pages)
+        return text_pages
+    except EncryptedPdfError:
+        print(f"The file is encrypted and cannot be read: {pdf_path}")
+        return []  # Skip this file
     except PdfReadError as e:
         print(f"Error reading the PDF file {pdf_path}: {e}")
-        return False
+        return None
     except IndexError as e:
         print(f"List index out of range error processing the file {pdf_path}: {e}")
-        return False
+        return None
     except Exception as e:
         print(f"General error processing the file {pdf_path}: {e}")
+        return None
+
+def pages_needing_ocr(text_pages):
+    """Returns the indices of pages without text, or None (all pages) if classification failed."""
+    if text_pages is None:
+        return None
+    return [i for i, has_text in enumerate(text_pages) if not has_text]
+
+def repair_pdf_in_process(pdf_path, repaired_pdf_path, backend=DEFAULT_BACKEND):
+    """Writes a repaired copy of the PDF by opening and rewriting it with the backend.
+    
+    Both libraries rebuild a broken xref table and recover objects by scanning the file
+    while opening it, which fixes most damaged files in a fraction of Ghostscript's time.
+    """
+    try:
+        document = open_backend(backend, pdf_path)
+        try:
+            if not document.page_count:
+                raise ValueError("no pages could be recovered")
+            for i in range(document.page_count):
+                document.keep_page(i)
+            document.save(repaired_pdf_path)
+        finally:
+            document.close()
+        return True
+    except Exception as e:
+        print(f"In-process PDF repair failed for {pdf_path}: {e}")
         return False
 
-def repair_pdf(pdf_path):
-    """Attempts to repair the PDF using Ghostscript."""
-    repaired_pdf_path = pdf_path.replace(".pdf", "_repaired.pdf")
+def repair_pdf_ghostscript(pdf_path, repaired_pdf_path):
+    """Writes a repaired copy of the PDF by rewriting the whole file with Ghostscript."""
     try:
         subprocess.run(['gs', '-o', repaired_pdf_path, '-sDEVICE=pdfwrite', '-dPDFSETTINGS=/prepress', pdf_path], check=True)
-        os.replace(repaired_pdf_path, pdf_path)
-        print(f"PDF repaired successfully: {pdf_path}")
         return True
-    except subprocess.CalledProcessError as e:
-        print(f"PDF repair failed for {pdf_path}: {e}")
-        if os.path.exists(repaired_pdf_path):
-            os.remove(repaired_pdf_path)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Ghostscript PDF repair failed for {pdf_path}: {e}")
         return False
 
-def add_ocr_to_pdf(input_pdf, output_pdf):
-    """Adds OCR layer to PDF using Tesseract and PDF2Image."""
+def repair_pdf(pdf_path, retry, backend=DEFAULT_BACKEND, stats=None):
+    """Repairs the PDF in-process first and with Ghostscript only if that does not help.
+    
+    Each method writes a repaired copy next to the file, and `retry(repaired_path)` runs
+    the failed work again on it. A repair only counts if the retry succeeds; the original
+    file is left alone otherwise. Each attempt is timed, and successful repairs and their
+    time are added to the `stats` Counter.
+    """
+    attempts = (
+        ('in-process', 'repaired_in_process', lambda path: repair_pdf_in_process(pdf_path, path, backend)),
+        ('Ghostscript', 'repaired_ghostscript', lambda path: repair_pdf_ghostscript(pdf_path, path)),
+    )
+    for method, counter, repair in attempts:
+        repaired_pdf_path = make_sibling_temp(pdf_path, "_repaired.pdf")
+        try:
+            start = time.monotonic()
+            repaired = repair(repaired_pdf_path)
+            elapsed = time.monotonic() - start
+            if repaired and retry(repaired_pdf_path):
+                print(f"PDF repaired successfully ({method}, {elapsed:.2f}s): {pdf_path}")
+                if stats is not None:
+                    with STATS_LOCK:
+                        stats[counter] += 1
+                        stats['repair_seconds'] += elapsed
+                return True
+            print(f"{method} repair attempt took {elapsed:.2f}s and did not help: {pdf_path}")
+        finally:
+            if os.path.exists(repaired_pdf_path):
+                os.remove(repaired_pdf_path)
+    return False
+
+def decode_image_xobject(xobject):
+    """Decodes an image XObject into a PIL image, or returns None if the encoding is unsupported."""
+    filters = xobject.get("/Filter")
+    if filters is None:
+        filters = []
+    elif not isinstance(filters, ArrayObject):
+        filters = [filters]
+    data = xobject.get_data()
+    
+    # PyPDF2 passes JPEG and JPEG 2000 data through undecoded, which PIL opens directly
+    if filters and filters[-1] in ("/DCTDecode", "/JPXDecode"):
+        image = Image.open(io.BytesIO(data))
+    else:
+        color_space = xobject.get("/ColorSpace")
+        color_space = color_space.get_object() if color_space is not None else None
+        if isinstance(color_space, ArrayObject) and color_space[0] == "/ICCBased":
+            # ICC profiles are close enough to their device space for OCR
+            color_space = ICC_COLOR_SPACES.get(color_space[1].get_object().get("/N"))
+        mode = RAW_IMAGE_MODES.get((color_space, xobject.get("/BitsPerComponent")))
+        if mode is None or xobject.get("/Decode") is not None:
+            return None
+        image = Image.frombytes(mode, (xobject["/Width"], xobject["/Height"]), data)
+    
+    if image.mode not in ("1", "L", "RGB"):
+        image = image.convert("RGB")
+    return image
+
+def extract_scan_image(page):
+    """Returns (image, dpi) if the page is exactly one full-page image, otherwise None.
+    
+    Such pages (the usual output of a scanner) can be OCRed from the embedded image at its
+    native resolution. Pages with fonts, several images, vector content, masks or
+    rotation return None and are rendered instead.
+    """
+    if page.get("/Rotate", 0) % 360 or "/Contents" not in page:
+        return None
+    resources = page.get("/Resources")
+    if resources is None:
+        return None
+    resources = resources.get_object()
+    xobjects = resources.get("/XObject")
+    if resources.get("/Font") or not xobjects:
+        return None
+    xobjects = xobjects.get_object()
+    if len(xobjects) != 1:
+        return None
+    name, xobject = next(iter(xobjects.items()))
+    xobject = xobject.get_object()
+    if xobject.get("/Subtype") != "/Image" or xobject.get("/ImageMask") or "/SMask" in xobject:
+        return None
+    
+    # The content stream may only place that image: q/Q, one cm and the Do
+    tokens = _stream_data(page["/Contents"]).split()
+    if any(token not in (b"q", b"Q", b"cm", b"Do", name.encode()) and not NUMBER_RE.fullmatch(token)
+           for token in tokens):
+        return None
+    if tokens.count(b"cm") != 1 or tokens.count(b"Do") != 1:
+        return None
+    cm_index = tokens.index(b"cm")
+    a, b, c, d, e, f = (float(token) for token in tokens[cm_index - 6:cm_index])
+    
+    # The image must cover the page without rotation or skew
+    box = page.mediabox
+    width, height = float(box.width), float(box.height)
+    if b or c or abs(a - width) > width * FULL_PAGE_TOLERANCE or abs(d - height) > height * FULL_PAGE_TOLERANCE:
+        return None
+    if abs(e - float(box.left)) > width * FULL_PAGE_TOLERANCE or abs(f - float(box.bottom)) > height * FULL_PAGE_TOLERANCE:
+        return None
+    
     try:
-        # Convert PDF to images with specific DPI
-        images = convert_from_path(input_pdf, dpi=300)
-        pdf_writer = PdfWriter()
-        pdf_reader = PdfReader(input_pdf)
-        
-        for i, image in enumerate(images):
-            # Get original page dimensions
-            original_page = pdf_reader.pages[i]
-            width = float(original_page.mediabox.width)
-            height = float(original_page.mediabox.height)
-            
-            # Resize image to match original dimensions
-            image = image.resize((int(width), int(height)), Image.Resampling.LANCZOS)
-            
-            # Perform OCR with specific DPI setting
-            text = pytesseract.image_to_pdf_or_hocr(
-                image,
-                extension='pdf',
-                config='--dpi 300'
-            )
-            
-            temp_pdf = f'temp_ocr_{i}.pdf'
-            with open(temp_pdf, 'wb') as f:
-                f.write(text)
-            
-            ocr_reader = PdfReader(temp_pdf)
-            page = pdf_reader.pages[i]
+        image = decode_image_xobject(xobject)
+    except Exception:
+        return None
+    if image is None:
+        return None
+    return image, image.width * 72 / width
+
+def _consecutive_runs(indices):
+    """Splits sorted page indices into runs of consecutive pages."""
+    runs = []
+    for i in indices:
+        if runs and runs[-1][-1] == i - 1:
+            runs[-1].append(i)
+        else:
+            runs.append([i])
+    return runs
+
+def load_page_window(input_pdf, pdf_reader, page_indices):
+    """Returns a list of (page_index, image, dpi) for a window of pages, and how many of
+    them came straight from an embedded scan image.
+    
+    Scanned pages use their embedded image directly; the rest are rendered at OCR_DPI
+    with one convert_from_path call per run of consecutive pages.
+    """
+    images = {}
+    to_render = []
+    for i in page_indices:
+        scan = extract_scan_image(pdf_reader.pages[i])
+        if scan is None:
+            to_render.append(i)
+        else:
+            images[i] = scan
+    
+    for run in _consecutive_runs(to_render):
+        rendered = convert_from_path(input_pdf, dpi=OCR_DPI, first_page=run[0] + 1, last_page=run[-1] + 1)
+        for i, image in zip(run, rendered):
+            images[i] = (image, OCR_DPI)
+    
+    return [(i, *images[i]) for i in page_indices], len(page_indices) - len(to_render)
+
+def ocr_page_image(image, dpi):
+    """Runs Tesseract on one page image and returns the single-page OCR PDF as bytes.
+    
+    The PDF holds just the invisible text (textonly_pdf), not the image itself: it is
+    merged onto the original page, which already shows the scan.
+    """
+    return pytesseract.image_to_pdf_or_hocr(
+        image,
+        extension='pdf',
+        config=f'--dpi {round(dpi)} -c textonly_pdf=1'
+    )
+
+def get_engine():
+    """Returns this thread's tesserocr engine, creating it on first use."""
+    engine = getattr(_engines, 'api', None)
+    if engine is None:
+        engine = tesserocr.PyTessBaseAPI()
+        _engines.api = engine
+    return engine
+
+def _tesserocr_words(image, dpi):
+    """Recognises a page with the thread's persistent engine; see ocr_page_words."""
+    engine = get_engine()
+    engine.SetImage(image)
+    engine.SetSourceResolution(round(dpi))
+    engine.Recognize()
+    
+    width, height = image.size
+    level = tesserocr.RIL.WORD
+    words = []
+    iterator = engine.GetIterator()
+    for word in tesserocr.iterate_level(iterator, level):
+        text = (word.GetUTF8Text(level) or '').strip()
+        box = word.BoundingBox(level)
+        if text and box:
+            left, top, right, bottom = box
+            words.append((text, left / width, top / height, right / width, bottom / height,
+                          word.Confidence(level)))
+    engine.Clear()
+    return words
+
+def ocr_page_words(image, dpi, engine=DEFAULT_ENGINE):
+    """Runs Tesseract on one page image and returns its words as (text, x0, y0, x1, y1, conf).
+    
+    Coordinates are fractions of the image size, measured from the top left corner.
+    """
+    if engine == 'tesserocr':
+        return _tesserocr_words(image, dpi)
+    data = pytesseract.image_to_data(image, config=f'--dpi {round(dpi)}',
+                                     output_type=pytesseract.Output.DICT)
+    width, height = image.size
+    words = []
+    for text, left, top, box_width, box_height, conf in zip(data['text'], data['left'], data['top'],
+                                                            data['width'], data['height'], data['conf']):
+        text = text.strip()
+        if text:
+            words.append((text, left / width, top / height,
+                          (left + box_width) / width, (top + box_height) / height, float(conf)))
+    return words
+
+def _box_mean(values, size):
+    """Mean over a size x size box around every pixel, via an integral image."""
+    half = size // 2
+    padded = np.pad(values, ((half + 1, half), (half + 1, half)), mode='edge')
+    integral = padded.cumsum(axis=0).cumsum(axis=1)
+    total = (integral[size:, size:] - integral[:-size, size:]
+             - integral[size:, :-size] + integral[:-size, :-size])
+    return total / (size * size)
+
+def binarize(gray):
+    """Adaptive (Bradley) thresholding: a pixel is ink if clearly darker than its neighbourhood."""
+    gray = gray.astype(np.float64)
+    size = max(3, (gray.shape[1] // BINARIZE_WINDOW_FRACTION) | 1)
+    return gray < _box_mean(gray, size) * (1 - BINARIZE_SENSITIVITY)
+
+def despeckle(ink):
+    """Removes isolated ink pixels (no ink among their 8 neighbours)."""
+    padded = np.pad(ink, 1).astype(np.uint8)
+    neighbours = sum(padded[1 + dy:padded.shape[0] - 1 + dy, 1 + dx:padded.shape[1] - 1 + dx]
+                     for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dy or dx)
+    return ink & (neighbours > 0)
+
+def find_skew_angle(ink):
+    """Estimates the skew of a binarised page in degrees via projection profiles.
+    
+    The page is rotated over a range of candidate angles; the angle whose row sums
+    (ink per text line) have the highest variance aligns the lines horizontally.
+    Returns the angle that PIL's rotate() needs to straighten the page.
+    """
+    factor = max(1, ink.shape[1] // DESKEW_SAMPLE_WIDTH)
+    sample = Image.fromarray(ink[::factor, ::factor].astype(np.uint8) * 255)
+    
+    def score(angle):
+        rotated = np.asarray(sample.rotate(angle, resample=Image.Resampling.NEAREST), dtype=np.float32)
+        return rotated.sum(axis=1).var()
+    
+    # Coarse search in whole degrees, then refine around the best candidate
+    best = max(np.arange(-DESKEW_MAX_ANGLE, DESKEW_MAX_ANGLE + 1, 1.0), key=score)
+    best = max(np.arange(best - 1, best + 1.01, DESKEW_STEP), key=score)
+    return float(best)
+
+def preprocess_page(image):
+    """Deskews, binarises and despeckles a page image before OCR.
+    
+    Returns the cleaned black-and-white image and the rotation applied to it (degrees,
+    counter-clockwise), which is needed to map OCR coordinates back onto the page.
+    """
+    ink = despeckle(binarize(np.asarray(image.convert('L'))))
+    angle = find_skew_angle(ink)
+    cleaned = Image.fromarray(np.where(ink, 0, 255).astype(np.uint8))
+    if abs(angle) >= DESKEW_STEP / 2:
+        cleaned = cleaned.rotate(angle, resample=Image.Resampling.BILINEAR, fillcolor=255)
+    else:
+        angle = 0.0
+    return cleaned, angle
+
+def unrotate_words(words, angle, width, height):
+    """Maps word boxes found on a page rotated by `angle` back onto the unrotated page."""
+    if not angle:
+        return words
+    radians = math.radians(-angle)
+    cos, sin = math.cos(radians), math.sin(radians)
+    mapped = []
+    for text, x0, y0, x1, y1, conf in words:
+        # Rotate the box centre around the page centre (in pixels, y pointing down)
+        dx = ((x0 + x1) / 2 - 0.5) * width
+        dy = ((y0 + y1) / 2 - 0.5) * height
+        shift_x = (dx * cos + dy * sin - dx) / width
+        shift_y = (-dx * sin + dy * cos - dy) / height
+        mapped.append((text, x0 + shift_x, y0 + shift_y, x1 + shift_x, y1 + shift_y, conf))
+    return mapped
+
+def add_text_layer(pdf_writer, page, words):
+    """Writes `words` as invisible text (render mode 3) straight into the content stream of
+    `page`, which must already belong to `pdf_writer`.
+    
+    The original content is wrapped in q/Q and left untouched, so nothing has to be parsed
+    or merged. Each word is stretched horizontally (Tz) to cover its box on the scan.
+    """
+    box = page.mediabox
+    left, bottom = float(box.left), float(box.bottom)
+    width, height = float(box.width), float(box.height)
+    
+    layer = [b"Q", b"BT", b"3 Tr"]
+    for text, x0, y0, x1, y1, _ in words:
+        encoded = text.encode('cp1252', 'replace')
+        font_size = (y1 - y0) * height
+        box_width = (x1 - x0) * width
+        if font_size <= 0 or box_width <= 0:
+            continue
+        horizontal_scale = 100 * box_width / (font_size * TEXT_LAYER_CHAR_WIDTH * len(encoded))
+        escaped = encoded.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+        layer.append(b"%s %.2f Tf %.2f Tz 1 0 0 1 %.2f %.2f Tm (%s) Tj" % (
+            TEXT_LAYER_FONT.encode(), font_size, horizontal_scale,
+            left + x0 * width, bottom + (1 - y1) * height, escaped))
+    layer.append(b"ET")
+    
+    # Register a standard Type1 font, which needs no embedding
+    if "/Resources" not in page:
+        page[NameObject("/Resources")] = DictionaryObject()
+    resources = page["/Resources"].get_object()
+    if "/Font" not in resources:
+        resources[NameObject("/Font")] = DictionaryObject()
+    resources["/Font"].get_object()[NameObject(TEXT_LAYER_FONT)] = DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+        NameObject("/Encoding"): NameObject("/WinAnsiEncoding"),
+    })
+    
+    contents = page.get("/Contents")
+    if contents is None:
+        parts = []
+    elif isinstance(contents.get_object(), ArrayObject):
+        parts = list(contents.get_object())
+    else:
+        parts = [contents]
+    opening = DecodedStreamObject()
+    opening.set_data(b"q\n")
+    closing = DecodedStreamObject()
+    closing.set_data(b"\n".join(layer))
+    # Streams must be indirect objects owned by the writer
+    page[NameObject("/Contents")] = ArrayObject([pdf_writer._add_object(opening), *parts,
+                                                 pdf_writer._add_object(closing.flate_encode())])
+
+def is_blank_page(image, ink_threshold=BLANK_INK_THRESHOLD):
+    """Detects blank or near-blank pages on a downsampled greyscale copy of the page.
+    
+    A page is blank when almost no pixels are clearly darker than the paper (ink coverage
+    below `ink_threshold`) or when the whole page is nearly uniform (low variance), which
+    also catches faint bleed-through on the backs of duplex scans.
+    """
+    # Downsample by taking the darkest pixel of each block, so thin strokes survive
+    factor = max(1, image.width // BLANK_SAMPLE_WIDTH)
+    gray = np.asarray(image.convert('L'))
+    rows, cols = gray.shape[0] // factor, gray.shape[1] // factor
+    gray = gray[:rows * factor, :cols * factor].reshape(rows, factor, cols, factor).min(axis=(1, 3))
+    gray = gray.astype(np.float32)
+    
+    # Ignore the margins, where scanners leave shadows and punch holes
+    margin_y = int(gray.shape[0] * BLANK_MARGIN)
+    margin_x = int(gray.shape[1] * BLANK_MARGIN)
+    gray = gray[margin_y:gray.shape[0] - margin_y, margin_x:gray.shape[1] - margin_x]
+    if gray.size == 0:
+        return True
+    
+    if gray.std() < BLANK_STDDEV_THRESHOLD:
+        return True
+    paper = np.median(gray)
+    ink_coverage = np.count_nonzero(gray < paper - BLANK_INK_CONTRAST) / gray.size
+    return ink_coverage < ink_threshold
+
+def run_page_ocr(image, dpi, config, page_cache=None):
+    """Page worker: returns the OCR result for one page image, or None if the page is blank.
+    
+    The result is a word list for the 'hocr' layer, and (pdf_bytes, angle) for the 'pdf'
+    layer, where `angle` is the deskew rotation the OCR page must be turned back by.
+    Word lists are looked up in and added to `page_cache`, if given.
+    """
+    if config['blank_threshold'] and is_blank_page(image, config['blank_threshold']):
+        return None
+    if config['layer'] == 'hocr' and page_cache is not None:
+        key = page_hash(image)
+        words = page_cache.get(key)
+        if words is None:
+            words = run_page_ocr(image, dpi, dict(config, blank_threshold=0))
+            page_cache.put(key, words)
+        return words
+    angle = 0.0
+    if config['preprocess']:
+        width, height = image.size
+        image, angle = preprocess_page(image)
+    if config['layer'] == 'hocr':
+        words = ocr_page_words(image, dpi, config['engine'])
+        return unrotate_words(words, angle, width, height) if angle else words
+    # Only the text is merged, so neither a second copy of the scan nor the cleaned bitmap
+    # ends up on the original page
+    return ocr_page_image(image, dpi), angle
+
+class EncryptedPdfError(Exception):
+    """Raised when a backend cannot open an encrypted PDF with an empty password."""
+
+class PyPDFBackend:
+    """PyPDF2 for text detection and writing, pdf2image (poppler) for rendering.
+    
+    Pages are written to a new document, so keep_page/add_words/add_ocr_pdf must be
+    called once for every page, in page order.
+    """
+
+    def __init__(self, pdf_path):
+        self.pdf_path = pdf_path
+        self.reader = PdfReader(pdf_path)
+        if self.reader.is_encrypted:
+            try:
+                decrypted = self.reader.decrypt('')
+            except Exception:
+                decrypted = False
+            if not decrypted:
+                raise EncryptedPdfError(pdf_path)
+        self.writer = PdfWriter()
+
+    @property
+    def page_count(self):
+        return len(self.reader.pages)
+
+    def page_has_text(self, i):
+        return page_has_text(self.reader.pages[i])
+
+    def page_text(self, i, written=False):
+        """Text of page `i`, of the input or (`written`) of the page as written so far."""
+        pages = self.writer.pages if written else self.reader.pages
+        return pages[i].extract_text()
+
+    def load_pages(self, page_indices):
+        return load_page_window(self.pdf_path, self.reader, page_indices)
+
+    def keep_page(self, i):
+        self.writer.add_page(self.reader.pages[i])
+
+    def add_words(self, i, words):
+        add_text_layer(self.writer, self.writer.add_page(self.reader.pages[i]), words)
+
+    def add_ocr_pdf(self, i, ocr_pdf, angle):
+        page = self.reader.pages[i]
+        
+        # Parse the OCR page straight from memory, no temp files
+        ocr_reader = PdfReader(io.BytesIO(ocr_pdf))
+        
+        # Scale OCR layer to match original page
+        ocr_layer = ocr_reader.pages[0]
+        width, height = float(page.mediabox.width), float(page.mediabox.height)
+        ocr_layer.scale_to(width, height)
+        if angle:
+            # Undo the deskew rotation around the page centre
+            ocr_layer.add_transformation(Transformation().translate(-width / 2, -height / 2)
+                                         .rotate(-angle).translate(width / 2, height / 2))
+        
+        page.merge_page(ocr_layer)
+        self.writer.add_page(page)
+
+    def save(self, output_pdf):
+        with open(output_pdf, 'wb') as f:
+            self.writer.write(f)
+
+    def close(self):
+        pass
+
+class MuPDFBackend:
+    """PyMuPDF for text detection, rendering and writing, all in-process.
+    
+    Pages are changed in place and the document is saved once, so pages kept unchanged
+    cost nothing. Only the OCR itself runs outside MUPDF_LOCK.
+    """
+
+    def __init__(self, pdf_path):
+        with MUPDF_LOCK:
+            self.doc = fitz.open(pdf_path)
+            if self.doc.needs_pass and not self.doc.authenticate(''):
+                self.doc.close()
+                raise EncryptedPdfError(pdf_path)
+
+    @property
+    def page_count(self):
+        return self.doc.page_count
+
+    def page_has_text(self, i):
+        """Same check as page_has_text: fonts plus text operators in the page or its form
+        XObjects, so classifying a page does not extract its text."""
+        with MUPDF_LOCK:
+            page = self.doc[i]
+            if not page.get_fonts():
+                return False
+            if TEXT_OPERATOR_RE.search(page.read_contents()):
+                return True
+            return any(TEXT_OPERATOR_RE.search(self.doc.xref_stream(xobject[0]) or b"")
+                       for xobject in page.get_xobjects())
+
+    def page_text(self, i, written=False):
+        """Text of page `i`; pages are changed in place, so `written` makes no difference."""
+        with MUPDF_LOCK:
+            return self.doc[i].get_text("text")
+
+    def _scan_image(self, page):
+        """MuPDF counterpart of extract_scan_image: (image, dpi) of a page that is exactly
+        one full-page image, otherwise None."""
+        if page.rotation or page.get_fonts():
+            return None
+        images = page.get_images(full=True)
+        if len(images) != 1:
+            return None
+        xref, smask = images[0][:2]
+        if smask or not images[0][5]:
+            # Soft masks and stencil masks (no colour space) need the page background
+            return None
+        placements = page.get_image_rects(xref, transform=True)
+        if len(placements) != 1 or page.get_drawings():
+            return None
+        rect, matrix = placements[0]
+        
+        # The image must cover the page without rotation or skew
+        bounds = page.rect
+        width, height = bounds.width, bounds.height
+        if matrix.b or matrix.c:
+            return None
+        if abs(rect.x0 - bounds.x0) > width * FULL_PAGE_TOLERANCE or abs(rect.x1 - bounds.x1) > width * FULL_PAGE_TOLERANCE:
+            return None
+        if abs(rect.y0 - bounds.y0) > height * FULL_PAGE_TOLERANCE or abs(rect.y1 - bounds.y1) > height * FULL_PAGE_TOLERANCE:
+            return None
+        
+        try:
+            pixmap = fitz.Pixmap(self.doc, xref)
+            if pixmap.n not in (1, 3) or pixmap.alpha:
+                pixmap = fitz.Pixmap(fitz.csRGB, pixmap)
+        except Exception:
+            return None
+        image = Image.frombytes("L" if pixmap.n == 1 else "RGB", (pixmap.width, pixmap.height), pixmap.samples)
+        return image, pixmap.width * 72 / width
+
+    def load_pages(self, page_indices):
+        """Same contract as load_page_window; pages that are not plain scans are rendered at OCR_DPI."""
+        pages = []
+        direct_count = 0
+        with MUPDF_LOCK:
+            for i in page_indices:
+                page = self.doc[i]
+                scan = self._scan_image(page)
+                if scan is None:
+                    pixmap = page.get_pixmap(dpi=OCR_DPI, alpha=False)
+                    scan = (Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples), OCR_DPI)
+                else:
+                    direct_count += 1
+                pages.append((i, *scan))
+        return pages, direct_count
+
+    def keep_page(self, i):
+        pass
+
+    def add_words(self, i, words):
+        """Writes `words` as invisible text (render mode 3), shrinking words wider than their box.
+        
+        The boxes are fractions of the rendered page, i.e. of the page as displayed; they are
+        mapped back to unrotated coordinates and the text is turned with the page's /Rotate.
+        """
+        with MUPDF_LOCK:
+            page = self.doc[i]
+            bounds = page.rect
+            derotate = page.derotation_matrix
+            shape = page.new_shape()
+            for text, x0, y0, x1, y1, _ in words:
+                font_size = (y1 - y0) * bounds.height
+                box_width = (x1 - x0) * bounds.width
+                if font_size <= 0 or box_width <= 0:
+                    continue
+                text_width = fitz.get_text_length(text, fontname=MUPDF_TEXT_FONT, fontsize=font_size)
+                if text_width > box_width:
+                    font_size *= box_width / text_width
+                origin = fitz.Point(bounds.x0 + x0 * bounds.width, bounds.y0 + y1 * bounds.height) * derotate
+                shape.insert_text(origin, text, fontname=MUPDF_TEXT_FONT, fontsize=font_size,
+                                  rotate=page.rotation, render_mode=3)
+            shape.commit()
+
+    def add_ocr_pdf(self, i, ocr_pdf, angle):
+        with MUPDF_LOCK:
+            page = self.doc[i]
+            target = page.rect
+            if angle:
+                # show_pdf_page fits the rotated layer into the target, so the target must be
+                # the bounding box of the rotated page for the layer to keep its size
+                radians = math.radians(angle)
+                cos, sin = abs(math.cos(radians)), abs(math.sin(radians))
+                width = target.width * cos + target.height * sin
+                height = target.width * sin + target.height * cos
+                center = (target.tl + target.br) / 2
+                target = fitz.Rect(center.x - width / 2, center.y - height / 2,
+                                   center.x + width / 2, center.y + height / 2)
+            with fitz.open(stream=ocr_pdf, filetype="pdf") as ocr_doc:
+                # The layer matches the page as displayed: place it in unrotated coordinates,
+                # turned with the page's /Rotate, and undo the deskew rotation
+                # (show_pdf_page rotates counter-clockwise)
+                page.show_pdf_page(target * page.derotation_matrix, ocr_doc, 0, keep_proportion=False,
+                                   rotate=page.rotation - angle)
+
+    def save(self, output_pdf):
+        with MUPDF_LOCK:
+            self.doc.save(output_pdf, garbage=1, deflate=True)
+
+    def close(self):
+        with MUPDF_LOCK:
+            self.doc.close()
+
+def open_backend(backend, pdf_path):
+    """Opens `pdf_path` with the named backend (see BACKENDS)."""
+    if backend == 'pypdf':
+        return PyPDFBackend(pdf_path)
+    return MuPDFBackend(pdf_path)
+
+def add_ocr_to_pdf(input_pdf, output_pdf, config=None, page_pool=None, on_page=None,
+                   ocr_pages=None, stats=None, page_cache=None, page_texts=None, errors=None):
+    """Adds OCR layer to PDF using Tesseract and the configured backend.
+    
+    `config['layer']` selects between merging Tesseract's PDF page ('pdf') and writing
+    word boxes into the page directly ('hocr'). Only the page indices in `ocr_pages` are
+    OCRed (default: all pages); every other page, and every page found to be blank, is
+    copied through unchanged. Pages of each window are OCRed concurrently on `page_pool`
+    (shared between files in directory mode) and merged back in page order. `on_page` is
+    called once per OCRed page. Skipped blank pages are added to the `stats` Counter.
+    With the 'hocr' layer, repeated pages reuse their words from `page_cache`. If
+    `page_texts` is a dict, it receives the text of every output page (index -> text),
+    taken from the document in memory, so callers need not parse the output again. If
+    `errors` is a list, the exception that made the OCR fail is appended to it.
+    """
+    config = DEFAULT_CONFIG if config is None else config
+    window = config['window']
+    try:
+        document = open_backend(config['backend'], input_pdf)
+    except Exception as e:
+        print(f"Error processing the file {input_pdf}: {e}")
+        if errors is not None:
+            errors.append(e)
+        return False
+    try:
+        page_count = document.page_count
+        if ocr_pages is None:
+            ocr_pages = range(page_count)
+        ocr_pages = sorted(ocr_pages)
+        next_page = 0
+        direct_count = 0
+        blank_count = 0
+        
+        # Load page images window by window, never holding the whole document
+        for first in range(0, len(ocr_pages), window):
+            page_images, direct = document.load_pages(ocr_pages[first:first + window])
+            direct_count += direct
             
-            # Scale OCR layer to match original page
-            ocr_page = ocr_reader.pages[0]
-            ocr_page.scale_to(width, height)
+            if page_pool is None:
+                results = [run_page_ocr(image, dpi, config, page_cache) for _, image, dpi in page_images]
+            else:
+                futures = [page_pool.submit(run_page_ocr, image, dpi, config, page_cache)
+                           for _, image, dpi in page_images]
+                results = [future.result() for future in futures]
             
-            page.merge_page(ocr_page)
-            pdf_writer.add_page(page)
-            os.remove(temp_pdf)
+            for (i, image, _), result in zip(page_images, results):
+                image.close()
+                
+                # Pages that already have text go through untouched
+                while next_page < i:
+                    document.keep_page(next_page)
+                    next_page += 1
+                
+                if result is None:
+                    # Blank page, nothing to recognise
+                    document.keep_page(i)
+                    blank_count += 1
+                elif config['layer'] == 'hocr':
+                    document.add_words(i, result)
+                else:
+                    document.add_ocr_pdf(i, *result)
+                next_page = i + 1
+                if on_page is not None:
+                    on_page()
         
-        with open(output_pdf, 'wb') as f:
-            pdf_writer.write(f)
+        for i in range(next_page, page_count):
+            document.keep_page(i)
         
-        print(f"OCR successful for: {output_pdf}")
+        if page_texts is not None:
+            for i in range(page_count):
+                page_texts[i] = document.page_text(i, written=True)
+        
+        if direct_count:
+            print(f"{direct_count}/{len(ocr_pages)} page(s) OCRed from embedded scan images: {input_pdf}")
+        if blank_count:
+            print(f"Skipped OCR of {blank_count} blank page(s): {input_pdf}")
+            if stats is not None:
+                with STATS_LOCK:
+                    stats['blank_pages'] += blank_count
+        
+        document.save(output_pdf)
+        
+        print(f"OCR successful for: {input_pdf}")
         return True
     except Exception as e:
         print(f"Error processing the file {input_pdf}: {e}")
+        if errors is not None:
+            errors.append(e)
         return False
+    finally:
+        document.close()
+
+def _benchmark_page(image, dpi, preprocess, engine):
+    """Benchmark worker: OCRs one page and returns the confidences of its words."""
+    if preprocess:
+        image, _ = preprocess_page(image)
+    return [conf for *_, conf in ocr_page_words(image, dpi, engine) if conf >= 0]
 
-def process_pdf(pdf_path, output_path=None, check_only=False, repair=False):
-    """Processes a single PDF file - checks, repairs, or adds OCR."""
+def benchmark_preprocessing(pdf_path, page_pool, page_limit=BENCHMARK_PAGES, engine=DEFAULT_ENGINE,
+                            backend=DEFAULT_BACKEND):
+    """Prints OCR pages/sec and mean word confidence with and without preprocessing."""
+    document = open_backend(backend, pdf_path)
+    try:
+        page_images, _ = document.load_pages(range(min(page_limit, document.page_count)))
+    finally:
+        document.close()
+    print(f"Benchmarking preprocessing on {len(page_images)} page(s) of {pdf_path}")
+    
+    for preprocess in (False, True):
+        start = time.monotonic()
+        futures = [page_pool.submit(_benchmark_page, image, dpi, preprocess, engine)
+                   for _, image, dpi in page_images]
+        confidences = [conf for future in futures for conf in future.result()]
+        elapsed = time.monotonic() - start
+        
+        mean_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+        label = "with preprocessing" if preprocess else "without preprocessing"
+        print(f"  {label:<22} {len(page_images) / elapsed:6.2f} pages/sec, "
+              f"mean word confidence {mean_confidence:5.1f} ({len(confidences)} words)")
+    
+    for _, image, _ in page_images:
+        image.close()
+
+def benchmark_backends(pdf_path, page_limit=BENCHMARK_PAGES):
+    """Prints text detection, page loading and text layer writing times for each backend.
+    
+    OCR costs the same with every backend and is left out: a synthetic grid of words is
+    written into the first `page_limit` pages and the result is saved to a temp file.
+    """
+    words = [(f"word{row}x{col}", col / 8 + 0.01, row / 40 + 0.005, (col + 1) / 8 - 0.01,
+              (row + 1) / 40 - 0.005, 90.0) for row in range(40) for col in range(8)]
+    print(f"Benchmarking backends on {pdf_path}")
+    
+    for backend in BACKENDS:
+        fd, output_pdf = tempfile.mkstemp(suffix=".pdf")
+        os.close(fd)
+        document = open_backend(backend, pdf_path)
+        try:
+            page_count = document.page_count
+            start = time.monotonic()
+            for i in range(page_count):
+                document.page_has_text(i)
+            detect_time = time.monotonic() - start
+            
+            pages = range(min(page_limit, page_count))
+            start = time.monotonic()
+            page_images, direct = document.load_pages(pages)
+            load_time = time.monotonic() - start
+            for _, image, _ in page_images:
+                image.close()
+            
+            start = time.monotonic()
+            for i in range(page_count):
+                if i in pages:
+                    document.add_words(i, words)
+                else:
+                    document.keep_page(i)
+            document.save(output_pdf)
+            write_time = time.monotonic() - start
+            output_size = os.path.getsize(output_pdf)
+        finally:
+            document.close()
+            os.remove(output_pdf)
+        
+        print(f"  {backend:<8} detect {detect_time * 1000 / max(page_count, 1):7.2f} ms/page, "
+              f"load {load_time * 1000 / max(len(pages), 1):8.1f} ms/page ({direct}/{len(pages)} direct), "
+              f"write {write_time * 1000:8.1f} ms ({output_size / 1024:.0f} KiB)")
+
+def index_pdf(index, pdf_path, backend=DEFAULT_BACKEND, page_texts=None):
+    """Adds a file to the full-text index (a pdf_index.PdfIndex).
+    
+    Uses `page_texts` from add_ocr_to_pdf if given; otherwise the text is extracted, unless
+    the file is indexed already with its current size and mtime, or its content is known
+    under another path (then only the path is updated).
+    """
+    def extract_text():
+        document = open_backend(backend, pdf_path)
+        try:
+            return "\n".join(document.page_text(i) for i in range(document.page_count))
+        finally:
+            document.close()
+
+    try:
+        if page_texts is not None:
+            index.add(pdf_path, "\n".join(page_texts[i] for i in sorted(page_texts)))
+        elif not index.is_current(pdf_path):
+            index.add(pdf_path, extract_text)
+    except Exception as e:
+        print(f"Warning: Could not index {pdf_path}: {e}")
+
+def process_pdf(pdf_path, output_path=None, check_only=False, repair=False, config=None,
+                manifest=None, page_pool=None, on_page=None, stats=None, page_cache=None,
+                index=None):
+    """Processes a single PDF file - checks, repairs, or adds OCR.
+    
+    With a full-text `index`, the text of the processed file is added to it.
+    """
+    config = DEFAULT_CONFIG if config is None else config
+    text_pages = classify_pages(pdf_path, manifest, config['backend'])
+    ocr_pages = pages_needing_ocr(text_pages)
+    
     if check_only:
-        if has_embedded_text(pdf_path):
-            print(f"The file contains text: {pdf_path}")
-        else:
+        # classify_pages has already printed why a file could not be read
+        if text_pages is None:
+            print(f"The file could not be checked for text: {pdf_path}")
+            return False
+        if not text_pages:
+            print(f"The file has no readable pages, not checked for text: {pdf_path}")
+            return False
+        if len(ocr_pages) == len(text_pages):
             print(f"The file does not contain text: {pdf_path}")
+        elif ocr_pages:
+            print(f"The file contains text on {len(text_pages) - len(ocr_pages)}/{len(text_pages)} pages: {pdf_path}")
+        else:
+            print(f"The file contains text: {pdf_path}")
         return True
     
     # If output not specified, use input path as output (overwrite original)
     if output_path is None:
         output_path = pdf_path
-        temp_output_path = pdf_path.replace(".pdf", "_temp.pdf")
-    else:
-        temp_output_path = output_path
     
-    # Only process files without text
-    if not has_embedded_text(pdf_path):
+    # Only process files with pages that lack text
+    if ocr_pages is None or ocr_pages:
+        if ocr_pages and len(ocr_pages) < len(text_pages):
+            print(f"OCR of {len(ocr_pages)}/{len(text_pages)} page(s) without text: {pdf_path}")
+        if output_path == pdf_path:
+            temp_output_path = make_sibling_temp(pdf_path, "_temp.pdf")
+        else:
+            temp_output_path = output_path
+        page_texts = {} if index is not None else None
+        errors = []
         try:
-            success = add_ocr_to_pdf(pdf_path, temp_output_path)
+            success = add_ocr_to_pdf(pdf_path, temp_output_path, config=config,
+                                     page_pool=page_pool, on_page=on_page, ocr_pages=ocr_pages,
+                                     stats=stats, page_cache=page_cache, page_texts=page_texts,
+                                     errors=errors)
             
             # If successful and we're overwriting the original file
             if success and output_path == pdf_path:
                 os.replace(temp_output_path, pdf_path)
+            elif temp_output_path != output_path and os.path.exists(temp_output_path):
+                os.remove(temp_output_path)
             
-            return success
+            if success and manifest is not None and text_pages is not None:
+                manifest.put(output_path, [True] * len(text_pages))
+            if success and index is not None:
+                index_pdf(index, output_path, config['backend'], page_texts)
         except Exception as e:
             print(f"Error processing the file {pdf_path}: {e}")
-            if repair:
-                print(f"Attempting to repair the file: {pdf_path}")
-                if repair_pdf(pdf_path):
-                    # Retry after repair
-                    return process_pdf(pdf_path, output_path, check_only=False, repair=False)
-            return False
+            if temp_output_path != output_path and os.path.exists(temp_output_path):
+                os.remove(temp_output_path)
+            errors.append(e)
+            success = False
+        
+        if not success and repair:
+            if not any(isinstance(error, PDF_PARSE_ERRORS) for error in errors):
+                print(f"Not repairing, the error is not caused by a damaged PDF: {pdf_path}")
+                return False
+            print(f"Attempting to repair the file: {pdf_path}")
+            return repair_pdf(pdf_path, lambda repaired_path: process_repaired_pdf(
+                                  repaired_path, output_path, config, page_pool, on_page, stats, page_cache, index),
+                              config['backend'], stats)
+        return success
     else:
         print(f"Text already present in: {pdf_path}. Skipping file.")
+        if index is not None:
+            index_pdf(index, pdf_path, config['backend'])
         return True
 
-def process_directory(directory, check_only=False, repair=False):
-    """Recursively processes or checks all PDFs in a directory."""
+def process_repaired_pdf(repaired_path, output_path, config, page_pool=None, on_page=None, stats=None,
+                         page_cache=None, index=None):
+    """Retries process_pdf on a repaired copy and moves the result to `output_path` only if it
+    succeeds, so a failed attempt never touches the original."""
+    temp_output_path = make_sibling_temp(output_path, "_temp.pdf")
+    try:
+        if not process_pdf(repaired_path, temp_output_path, repair=False, config=config, page_pool=page_pool,
+                           on_page=on_page, stats=stats, page_cache=page_cache):
+            return False
+        # With text on every page nothing was written: the repaired copy is the result
+        if os.path.getsize(temp_output_path):
+            os.replace(temp_output_path, output_path)
+        else:
+            os.replace(repaired_path, output_path)
+    finally:
+        if os.path.exists(temp_output_path):
+            os.remove(temp_output_path)
+    if index is not None:
+        index_pdf(index, output_path, config['backend'])
+    return True
+
+class Progress:
+    """Thread-safe page counter that periodically reports pages/sec and an ETA."""
+
+    def __init__(self, total_pages, interval=PROGRESS_INTERVAL):
+        self.total_pages = total_pages
+        self.done_pages = 0
+        self.interval = interval
+        self.start_time = time.monotonic()
+        self.last_report = self.start_time
+        self.lock = threading.Lock()
+
+    def advance(self, pages=1):
+        with self.lock:
+            self.done_pages += pages
+            now = time.monotonic()
+            if now - self.last_report >= self.interval:
+                self.last_report = now
+                self._report(now)
+
+    def drop(self, pages):
+        """Removes pages that will never be processed (e.g. failed files) from the total."""
+        if pages > 0:
+            with self.lock:
+                self.total_pages -= pages
+
+    def finish(self):
+        with self.lock:
+            self._report(time.monotonic())
+
+    def _report(self, now):
+        elapsed = now - self.start_time
+        rate = self.done_pages / elapsed if elapsed > 0 else 0.0
+        remaining = max(self.total_pages - self.done_pages, 0)
+        if rate > 0:
+            eta = time.strftime('%H:%M:%S', time.gmtime(remaining / rate))
+        else:
+            eta = '--:--:--'
+        print(f"Progress: {self.done_pages}/{self.total_pages} pages, {rate:.2f} pages/sec, ETA {eta}")
+
+def get_page_count(pdf_path, backend=DEFAULT_BACKEND):
+    """Returns the number of pages in a PDF, or 0 if it cannot be read."""
+    try:
+        document = open_backend(backend, pdf_path)
+        try:
+            return document.page_count
+        finally:
+            document.close()
+    except Exception as e:
+        print(f"Could not count pages of {pdf_path}: {e}")
+        return 0
+
+def _ocr_job(pdf_path, page_count, progress, **kwargs):
+    """Runs process_pdf for one file of a directory run and keeps the progress total honest."""
+    done = [0]
+    
+    def on_page():
+        done[0] += 1
+        progress.advance()
+    
+    result = process_pdf(pdf_path, on_page=on_page, **kwargs)
+    progress.drop(page_count - done[0])
+    return result
+
+def process_directory(directory, check_only=False, repair=False, config=None,
+                      manifest=None, jobs=DEFAULT_JOBS, file_jobs=None, page_cache=None, index=None):
+    """Recursively processes or checks all PDFs in a directory.
+    
+    Files are OCRed concurrently, largest first (by page count), and all of them share a
+    single pool of `jobs` page workers, so the total number of Tesseract processes is
+    bounded no matter how many files are in flight.
+    """
+    # Without a persistent manifest, an in-memory one still avoids checking a file twice
+    if manifest is None:
+        manifest = TextManifest()
+    config = DEFAULT_CONFIG if config is None else config
+    if file_jobs is None:
+        # Enough files to keep the page workers busy while others are rasterising
+        file_jobs = max(1, jobs // config['window']) + 1
+    
     success_count = 0
     failure_count = 0
     skipped_count = 0
+    stats = Counter()
     
+    pending = []
     for root, _, files in os.walk(directory):
         for file in files:
             if file.lower().endswith(".pdf"):
                 pdf_path = os.path.join(root, file)
                 
                 if check_only:
-                    process_pdf(pdf_path, check_only=True)
+                    process_pdf(pdf_path, check_only=True, config=config, manifest=manifest)
                     continue
                 
-                if has_embedded_text(pdf_path):
+                ocr_pages = pages_needing_ocr(classify_pages(pdf_path, manifest, config['backend']))
+                if ocr_pages == []:
                     print(f"Text already present in: {pdf_path}. Skipping file.")
+                    if index is not None:
+                        index_pdf(index, pdf_path, config['backend'])
                     skipped_count += 1
                     continue
                 
-                result = process_pdf(pdf_path, repair=repair)
-                if result:
+                # Schedule by the number of pages that actually need OCR
+                page_count = get_page_count(pdf_path, config['backend']) if ocr_pages is None else len(ocr_pages)
+                pending.append((page_count, pdf_path))
+    
+    if pending:
+        # Largest first: long files start early and short ones fill the gaps at the end
+        pending.sort(key=lambda job: job[0], reverse=True)
+        progress = Progress(sum(page_count for page_count, _ in pending))
+        print(f"OCR of {len(pending)} file(s), {progress.total_pages} pages, "
+              f"{jobs} page worker(s), {file_jobs} file(s) at a time")
+        
+        # The file pool is listed last, so it shuts down before the page pool it feeds
+        with ThreadPoolExecutor(max_workers=jobs) as page_pool, \
+                ThreadPoolExecutor(max_workers=file_jobs) as file_pool:
+            futures = [file_pool.submit(_ocr_job, pdf_path, page_count, progress,
+                                        repair=repair, config=config, manifest=manifest,
+                                        page_pool=page_pool, stats=stats, page_cache=page_cache,
+                                        index=index)
+                       for page_count, pdf_path in pending]
+            for future in as_completed(futures):
+                if future.result():
                     success_count += 1
                 else:
                     failure_count += 1
+        progress.finish()
+    
+    manifest.save()
+    if page_cache is not None:
+        page_cache.save()
     
     if not check_only:
         print(f"\nSummary:")
         print(f"  Successfully processed: {success_count}")
         print(f"  Failed: {failure_count}")
-        print(f"  Skipped (text already present): {skipped_count}")
+        print(f"  Skipped (text already present on every page): {skipped_count}")
+        print(f"  Blank pages not OCRed: {stats['blank_pages']}")
+        if stats['repaired_in_process'] or stats['repaired_ghostscript']:
+            print(f"  Repaired: {stats['repaired_in_process']} in-process, "
+                  f"{stats['repaired_ghostscript']} with Ghostscript ({stats['repair_seconds']:.1f}s)")
+        if page_cache is not None:
+            page_cache.report()
 
 def main():
     parser = argparse.ArgumentParser(description='Add OCR layer to PDF files')
@@ -199,15 +1499,96 @@ def main():
     parser.add_argument('--output', help='Output PDF file (only for single file mode)')
     parser.add_argument('--check-only', action='store_true', help='Only check if PDFs have text without modifying')
     parser.add_argument('--repair', action='store_true', help='Try to repair damaged PDFs')
+    parser.add_argument('--window', type=int, default=PAGE_WINDOW,
+                        help=f'Number of pages rasterised at once (default: {PAGE_WINDOW})')
+    parser.add_argument('--blank-threshold', type=float, default=BLANK_INK_THRESHOLD,
+                        help='Pages with less ink coverage than this fraction are treated as blank '
+                             f'and not OCRed; 0 disables the check (default: {BLANK_INK_THRESHOLD})')
+    parser.add_argument('--preprocess', action='store_true',
+                        help='Deskew, binarise and despeckle page images before OCR')
+    parser.add_argument('--benchmark-preprocess', action='store_true',
+                        help=f'Compare OCR speed and word confidence with and without --preprocess on '
+                             f'the first {BENCHMARK_PAGES} pages of --input, without writing anything')
+    parser.add_argument('--engine', choices=ENGINES, default=DEFAULT_ENGINE,
+                        help='OCR engine for word boxes: persistent tesserocr engine per worker, or a '
+                             f'tesseract process per page (default: {DEFAULT_ENGINE})')
+    parser.add_argument('--layer', choices=LAYER_MODES, default=DEFAULT_CONFIG['layer'],
+                        help="How OCR text is added: merge Tesseract's PDF page ('pdf') or write "
+                             "word boxes into the page directly ('hocr', faster and smaller)")
+    parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS,
+                        help=f'Number of pages OCRed at once across all files (default: {DEFAULT_JOBS})')
+    parser.add_argument('--file-jobs', type=int,
+                        help='Number of files processed at once in directory mode (default: derived from --jobs)')
+    parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND,
+                        help='Library for text detection, rendering and writing: PyMuPDF in-process, '
+                             f'or PyPDF2 with pdf2image (default: {DEFAULT_BACKEND})')
+    parser.add_argument('--benchmark-backends', action='store_true',
+                        help='Compare text detection, page loading and text layer writing speed of '
+                             'the backends on --input, without changing it')
+    parser.add_argument('--page-cache',
+                        help='Cache file of OCR word layers keyed by a perceptual page hash, so repeated '
+                             'pages (cover sheets, letterheads) are only OCRed once (needs --layer hocr)')
+    parser.add_argument('--page-cache-distance', type=float, default=PAGE_CACHE_MAX_DISTANCE,
+                        help='Maximum fraction of differing hash bits for a cached page to be reused; '
+                             f'0 allows exact matches only (default: {PAGE_CACHE_MAX_DISTANCE})')
+    parser.add_argument('--index', metavar='DB',
+                        help='Add the text of processed files to this full-text index (see pdf_index.py)')
+    manifest_group = parser.add_mutually_exclusive_group()
+    manifest_group.add_argument('--manifest',
+                                help=f'Text detection cache file (default: {MANIFEST_NAME} in --dir)')
+    manifest_group.add_argument('--no-manifest', action='store_true',
+                                help='Do not read or write a text detection cache file')
     
     args = parser.parse_args()
     
+    if args.window < 1:
+        parser.error("--window must be at least 1")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.file_jobs is not None and args.file_jobs < 1:
+        parser.error("--file-jobs must be at least 1")
+    
+    if args.engine == 'tesserocr' and tesserocr is None:
+        parser.error("--engine tesserocr requires the tesserocr package")
+    
+    if args.page_cache and args.layer != 'hocr':
+        parser.error("--page-cache requires --layer hocr")
+    page_cache = PageCache(args.page_cache, args.page_cache_distance) if args.page_cache else None
+    
+    config = dict(DEFAULT_CONFIG, window=args.window, layer=args.layer,
+                  blank_threshold=args.blank_threshold, preprocess=args.preprocess,
+                  engine=args.engine, backend=args.backend)
+    
+    if args.benchmark_preprocess:
+        if not args.input:
+            parser.error("--benchmark-preprocess requires --input")
+        with ThreadPoolExecutor(max_workers=args.jobs) as page_pool:
+            benchmark_preprocessing(args.input, page_pool, engine=args.engine, backend=args.backend)
+        return
+    
+    if args.benchmark_backends:
+        if not args.input:
+            parser.error("--benchmark-backends requires --input")
+        benchmark_backends(args.input)
+        return
+    
+    index = pdf_index.PdfIndex(args.index) if args.index else None
+    
     # Process a single file
     if args.input:
         if args.output and args.check_only:
             parser.error("--output cannot be used with --check-only")
             
-        process_pdf(args.input, args.output, check_only=args.check_only, repair=args.repair)
+        manifest = TextManifest(args.manifest) if args.manifest else None
+        with ThreadPoolExecutor(max_workers=args.jobs) as page_pool:
+            process_pdf(args.input, args.output, check_only=args.check_only, repair=args.repair,
+                        config=config, manifest=manifest, page_pool=page_pool, page_cache=page_cache,
+                        index=index)
+        if manifest is not None:
+            manifest.save()
+        if page_cache is not None:
+            page_cache.report()
+            page_cache.save()
     
     # Process a directory recursively
     elif args.dir:
@@ -218,7 +1599,16 @@ def main():
             print(f"The specified directory does not exist: {args.dir}")
             sys.exit(1)
             
-        process_directory(args.dir, check_only=args.check_only, repair=args.repair)
+        if args.no_manifest:
+            manifest = None
+        else:
+            manifest = TextManifest(args.manifest or os.path.join(args.dir, MANIFEST_NAME))
+        process_directory(args.dir, check_only=args.check_only, repair=args.repair,
+                          config=config, manifest=manifest, jobs=args.jobs,
+                          file_jobs=args.file_jobs, page_cache=page_cache, index=index)
+    
+    if index is not None:
+        index.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
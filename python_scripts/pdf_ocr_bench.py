@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+Synthetic Benchmark for pdf_ocr.py
+
+This script measures OCR throughput and quality of pdf_ocr.py on a generated corpus of
+scanned documents with known text, so regressions show up as numbers instead of hunches.
+
+Features:
+- Generates image-only PDFs from random known text: noisy, slightly rotated page bitmaps
+- Stores the ground truth text of every page next to the corpus
+- Runs pdf_ocr.py in a subprocess per configuration, on a fresh copy of the corpus
+- Measures pages/sec, peak RSS of the OCR process and word accuracy against the ground truth
+- Sweeps worker counts and backends, results are saved as JSON
+
+Usage:
+    Generate a corpus (5 documents of 10 pages each):
+    ./pdf_ocr_bench.py generate --out bench_corpus --documents 5 --pages 10
+
+    Benchmark worker counts and backends:
+    ./pdf_ocr_bench.py run --corpus bench_corpus --jobs 1 2 4 --backends pymupdf pypdf \
+        --results bench_results.json
+"""
+
+import argparse
+import difflib
+import io
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import fitz  # PyMuPDF
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# pdf_ocr.py is expected next to this script
+PDF_OCR_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pdf_ocr.py")
+
+# Failure count in the summary printed by pdf_ocr.py in directory mode
+FAILED_RE = re.compile(r"^\s*Failed: (\d+)", re.MULTILINE)
+
+# Name of the ground truth file inside the corpus directory
+GROUND_TRUTH_NAME = "ground_truth.json"
+
+# Page geometry of generated scans (A4 at the given resolution)
+PAGE_WIDTH_INCHES = 8.27
+PAGE_HEIGHT_INCHES = 11.69
+DEFAULT_DPI = 300
+MARGIN_INCHES = 1.0
+FONT_SIZE_POINTS = 12
+LINE_SPACING = 1.6
+
+# Scan defects: standard deviation of the grey-level noise, maximum rotation in degrees
+DEFAULT_NOISE = 12.0
+DEFAULT_MAX_ROTATION = 1.5
+JPEG_QUALITY = 75
+
+# TrueType fonts tried in order; Pillow's built-in font is the fallback
+FONT_CANDIDATES = ("DejaVuSans.ttf", "Arial.ttf", "Helvetica.ttc", "LiberationSans-Regular.ttf")
+
+# Words of the generated text: common German and English words of varying length
+VOCABULARY = (
+    "der die das und ist nicht mit auf für eine Rechnung Vertrag Kunde Betrag Datum Seite "
+    "Versicherung Konto Zahlung Monat Jahr Bestellung Lieferung Adresse Telefon Nummer "
+    "the and of to invoice contract customer amount date page insurance account payment "
+    "month year order delivery address phone number total balance statement reference "
+    "2023 2024 15.03. 1.250,00 EUR 42 Nr. 7 Januar Februar März April Mai Juni"
+).split()
+
+def load_font(size):
+    """Returns the first available TrueType font at `size` pixels, or Pillow's default font."""
+    for name in FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size=size)
+
+def render_page(words, rng, dpi=DEFAULT_DPI, noise=DEFAULT_NOISE, max_rotation=DEFAULT_MAX_ROTATION):
+    """Renders `words` onto a scanned-looking greyscale page.
+
+    Returns the page image and the words that actually fit on the page, in reading order.
+    """
+    width, height = round(PAGE_WIDTH_INCHES * dpi), round(PAGE_HEIGHT_INCHES * dpi)
+    margin = round(MARGIN_INCHES * dpi)
+    font = load_font(round(FONT_SIZE_POINTS * dpi / 72))
+    line_height = round(FONT_SIZE_POINTS * dpi / 72 * LINE_SPACING)
+
+    image = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    space = draw.textlength(" ", font=font)
+    placed = []
+    x, y = margin, margin
+    for word in words:
+        draw_width = draw.textlength(word, font=font)
+        if x + draw_width > width - margin:
+            x, y = margin, y + line_height
+        if y + line_height > height - margin:
+            break
+        draw.text((x, y), word, fill=rng.randint(0, 60), font=font)
+        placed.append(word)
+        x += draw_width + space
+
+    # Scanner defects: a slight rotation, uneven paper tone and sensor noise
+    angle = rng.uniform(-max_rotation, max_rotation)
+    image = image.rotate(angle, resample=Image.Resampling.BILINEAR, fillcolor=255)
+    pixels = np.asarray(image, dtype=np.float32)
+    noise_rng = np.random.default_rng(rng.randrange(2 ** 32))
+    pixels = pixels - rng.uniform(0, 20) + noise_rng.normal(0, noise, pixels.shape)
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    return image, placed
+
+def generate_corpus(out_dir, documents, pages, seed=0, dpi=DEFAULT_DPI, noise=DEFAULT_NOISE,
+                    max_rotation=DEFAULT_MAX_ROTATION):
+    """Writes `documents` image-only PDFs of `pages` pages each, plus the ground truth JSON."""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    ground_truth = {}
+
+    for n in range(documents):
+        name = f"doc_{n:03d}.pdf"
+        page_texts = []
+        pdf = fitz.open()
+        for _ in range(pages):
+            words = [rng.choice(VOCABULARY) for _ in range(600)]
+            image, placed = render_page(words, rng, dpi=dpi, noise=noise, max_rotation=max_rotation)
+            page_texts.append(" ".join(placed))
+
+            # Embed the bitmap as a JPEG covering the whole page, like a scanner does
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", quality=JPEG_QUALITY)
+            page = pdf.new_page(width=image.width * 72 / dpi, height=image.height * 72 / dpi)
+            page.insert_image(page.rect, stream=buffer.getvalue())
+            image.close()
+        pdf.save(os.path.join(out_dir, name))
+        pdf.close()
+        ground_truth[name] = page_texts
+        print(f"Generated {name} ({pages} pages)")
+
+    with open(os.path.join(out_dir, GROUND_TRUTH_NAME), 'w', encoding='utf-8') as f:
+        json.dump(ground_truth, f, ensure_ascii=False, indent=1)
+    print(f"Corpus of {documents} document(s) written to {out_dir}")
+
+def word_accuracy(truth, recognised):
+    """Fraction of ground truth words found in order in the recognised words."""
+    if not truth:
+        return 1.0
+    matcher = difflib.SequenceMatcher(None, truth, recognised, autojunk=False)
+    return sum(block.size for block in matcher.get_matching_blocks()) / len(truth)
+
+def score_corpus(work_dir, ground_truth):
+    """Returns the word accuracy over all pages of the OCRed copy of the corpus."""
+    matched = 0.0
+    total = 0
+    for name, page_texts in ground_truth.items():
+        pdf = fitz.open(os.path.join(work_dir, name))
+        try:
+            for page, text in zip(pdf, page_texts):
+                truth = text.split()
+                recognised = page.get_text("text").split()
+                matched += word_accuracy(truth, recognised) * len(truth)
+                total += len(truth)
+        finally:
+            pdf.close()
+    return matched / total if total else 0.0
+
+def peak_rss_mb(rusage):
+    """Converts ru_maxrss to megabytes (kilobytes on Linux, bytes on macOS)."""
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return rusage.ru_maxrss * scale / (1024 * 1024)
+
+def run_configuration(corpus_dir, ground_truth, backend, jobs, extra_args):
+    """OCRs a fresh copy of the corpus with one configuration and returns its measurements."""
+    page_count = sum(len(pages) for pages in ground_truth.values())
+    with tempfile.TemporaryDirectory(prefix="pdf_ocr_bench_") as work_dir:
+        for name in ground_truth:
+            shutil.copy2(os.path.join(corpus_dir, name), work_dir)
+        command = [sys.executable, PDF_OCR_SCRIPT, '--dir', work_dir, '--no-manifest',
+                   '--backend', backend, '--jobs', str(jobs), *extra_args]
+
+        with tempfile.TemporaryFile() as log_file:
+            start = time.monotonic()
+            process = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT)
+            # wait4 reports the resource usage of this child alone (and the processes it waited for)
+            _, status, rusage = os.wait4(process.pid, 0)
+            elapsed = time.monotonic() - start
+            returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+            process.returncode = returncode
+            log_file.seek(0)
+            log = log_file.read().decode(errors='replace')
+
+        # pdf_ocr.py exits with 0 even if single files fail; its summary has the count
+        failed = FAILED_RE.search(log)
+
+        result = {
+            'backend': backend,
+            'jobs': jobs,
+            'args': extra_args,
+            'pages': page_count,
+            'seconds': round(elapsed, 3),
+            'pages_per_sec': round(page_count / elapsed, 3) if elapsed > 0 else 0.0,
+            'peak_rss_mb': round(peak_rss_mb(rusage), 1),
+            'returncode': returncode,
+            'failed_files': int(failed.group(1)) if failed else None,
+        }
+        if returncode == 0:
+            result['word_accuracy'] = round(score_corpus(work_dir, ground_truth), 4)
+        else:
+            result['error'] = (log.strip().splitlines() or [''])[-1]
+        return result
+
+def run_benchmark(corpus_dir, jobs_list, backends, extra_args, results_path):
+    """Runs every backend/worker count combination and saves the results as JSON."""
+    with open(os.path.join(corpus_dir, GROUND_TRUTH_NAME), 'r', encoding='utf-8') as f:
+        ground_truth = json.load(f)
+
+    runs = []
+    for backend in backends:
+        for jobs in jobs_list:
+            print(f"Running backend={backend} jobs={jobs} ...")
+            result = run_configuration(corpus_dir, ground_truth, backend, jobs, extra_args)
+            runs.append(result)
+            if result['returncode'] == 0:
+                print(f"  {result['pages_per_sec']:.2f} pages/sec, peak RSS {result['peak_rss_mb']:.0f} MB, "
+                      f"word accuracy {result['word_accuracy']:.1%}, {result['failed_files']} failed file(s)")
+            else:
+                print(f"  failed with exit code {result['returncode']}: {result['error']}")
+
+    results = {
+        'corpus': os.path.abspath(corpus_dir),
+        'documents': len(ground_truth),
+        'pages': sum(len(pages) for pages in ground_truth.values()),
+        'python': sys.version.split()[0],
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'runs': runs,
+    }
+    with open(results_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {results_path}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Synthetic scanned-PDF benchmark for pdf_ocr.py')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate = subparsers.add_parser('generate', help='Generate a corpus of scanned PDFs with ground truth')
+    generate.add_argument('--out', required=True, help='Output directory of the corpus')
+    generate.add_argument('--documents', type=int, default=5, help='Number of PDF files (default: 5)')
+    generate.add_argument('--pages', type=int, default=10, help='Pages per PDF file (default: 10)')
+    generate.add_argument('--seed', type=int, default=0, help='Random seed, same seed gives the same corpus')
+    generate.add_argument('--dpi', type=int, default=DEFAULT_DPI,
+                          help=f'Scan resolution (default: {DEFAULT_DPI})')
+    generate.add_argument('--noise', type=float, default=DEFAULT_NOISE,
+                          help=f'Standard deviation of the grey-level noise (default: {DEFAULT_NOISE})')
+    generate.add_argument('--max-rotation', type=float, default=DEFAULT_MAX_ROTATION,
+                          help=f'Maximum page rotation in degrees (default: {DEFAULT_MAX_ROTATION})')
+
+    run = subparsers.add_parser('run', help='Benchmark pdf_ocr.py on a generated corpus')
+    run.add_argument('--corpus', required=True, help='Corpus directory created with generate')
+    run.add_argument('--jobs', type=int, nargs='+', default=[1, os.cpu_count() or 1],
+                     help='Worker counts to compare (default: 1 and the number of CPUs)')
+    run.add_argument('--backends', nargs='+', default=['pymupdf', 'pypdf'],
+                     help='pdf_ocr.py backends to compare (default: pymupdf pypdf)')
+    run.add_argument('--results', default='pdf_ocr_bench_results.json',
+                     help='Output JSON file (default: pdf_ocr_bench_results.json)')
+    run.add_argument('pdf_ocr_args', nargs=argparse.REMAINDER,
+                     help='Further pdf_ocr.py options after --, e.g. -- --layer hocr --preprocess')
+
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        if args.documents < 1 or args.pages < 1:
+            parser.error("--documents and --pages must be at least 1")
+        generate_corpus(args.out, args.documents, args.pages, seed=args.seed, dpi=args.dpi,
+                        noise=args.noise, max_rotation=args.max_rotation)
+    else:
+        if not os.path.exists(os.path.join(args.corpus, GROUND_TRUTH_NAME)):
+            parser.error(f"{args.corpus} has no {GROUND_TRUTH_NAME}; create it with the generate command")
+        extra_args = [arg for arg in args.pdf_ocr_args if arg != '--']
+        run_benchmark(args.corpus, args.jobs, args.backends, extra_args, args.results)
+
+if __name__ == "__main__":
+    main()
@@ -3,18 +3,23 @@
 
 """
 This script takes a potentially unstructured text file as input, analyzes it, and generates
-a structured version in markdown.
+a structured version in markdown. The requests of each step run concurrently
+(--concurrency), and the results are put back together in the order of the text.
 
 Usage:
 ./text-enhancer.py raw-text.txt
+./text-enhancer.py --concurrency 16 manuscript.txt
 """
 
 from openai import OpenAI
 import argparse
 import os
 import math
+from concurrent.futures import ThreadPoolExecutor
 
-client = OpenAI()
+# Requests that hit the rate limit are retried by the client, waiting as the API asks;
+# with several requests at once this happens more often than with one
+client = OpenAI(max_retries=5)
 
 """
 We generate the structured version in several steps.
@@ -22,10 +27,14 @@ We generate the structured version in several steps.
 2. For any chunk create a summary sentence.
 3. For any raw text chunk, ask the model to do the proofread and provide the summaries 
 produced in the step before. 
+Within steps 2 and 3 the chunks do not depend on each other, so their requests run
+concurrently, up to DEFAULT_CONCURRENCY (or --concurrency) at a time.
 """
 
 MAX_CHUNK_SIZE = 8000
 
+DEFAULT_CONCURRENCY = 8
+
 SUMMARY_MODEL = "gpt-4o-mini" # simple task, so use a simple model
 SUMMARY_PROMPT = """Das ist ein Abschnitt aus einem längeren Text. 
 Fasse den Abschnitt in einem Satz zusammen. Gib direkt wieder, 
@@ -86,7 +95,7 @@ def proofread_text(chunk, chunk_number, all_summaries):
     # print (completion.choices[0].message.content.strip())
     return completion.choices[0].message.content.strip()
 
-def enhance_text(file_path):
+def enhance_text(file_path, concurrency=DEFAULT_CONCURRENCY):
     # Read the input text file
     with open(file_path, 'r') as file:
         raw_text = file.read()
@@ -105,19 +114,20 @@ def enhance_text(file_path):
             slices.append(raw_text[start_index:end_index])
             start_index = end_index
     
-    # Create summaries for each chunk
-    summaries = []
-    for i, slice in enumerate(slices, start=1):
-        summary = get_summary(slice)
-        summaries.append(f"Chunk {i}: {summary}")
-    
-    all_summaries = "\n".join(summaries)
-    structured_text = ""
-    
-    # Proofread each chunk with the context of all summaries
-    for i, slice in enumerate(slices, start=1):
-        enhanced_chunk = proofread_text(slice, i, all_summaries)
-        structured_text += enhanced_chunk + "\n\n"
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # Create summaries for each chunk (map returns them in chunk order)
+        print(f"Summarizing {len(slices)} chunk(s)...")
+        summaries = []
+        for i, summary in enumerate(pool.map(get_summary, slices), start=1):
+            summaries.append(f"Chunk {i}: {summary}")
+        
+        all_summaries = "\n".join(summaries)
+        
+        # Proofread each chunk with the context of all summaries
+        print(f"Proofreading {len(slices)} chunk(s)...")
+        enhanced_chunks = pool.map(proofread_text, slices, range(1, len(slices) + 1),
+                                   [all_summaries] * len(slices))
+        structured_text = "".join(enhanced_chunk + "\n\n" for enhanced_chunk in enhanced_chunks)
     
     return structured_text
 
@@ -125,10 +135,14 @@ if __name__ == "__main__":
     # Set up argument parsing
     parser = argparse.ArgumentParser(description="Enhance and structure a plain text.")
     parser.add_argument("file_path", help="Path to the text file")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Number of requests sent at the same time (default: {DEFAULT_CONCURRENCY})")
     args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
     
     # Get the structured text
-    structured_text = enhance_text(args.file_path)
+    structured_text = enhance_text(args.file_path, args.concurrency)
     
     # Save the structured text to a markdown file
     output_file = args.file_path.replace(".txt", "_structured.md")
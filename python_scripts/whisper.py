@@ -2,123 +2,907 @@
 # coding: utf-8
 
 """
-This script processes audio files for transcription using OpenAI’s API. It first checks if 
-the file size exceeds a specified limit (25 MB). If so, it evaluates the audio bitrate and,
-if necessary, transcodes the file to a lower bitrate of 64 kbps to reduce file size. 
-The script then checks the audio duration; if it exceeds 30 minutes, the file is split 
-into 30-minute segments. Each segment is transcribed, and the resulting text is saved 
-into a transcript.txt file in a temporary directory. This script ensures efficient handling 
+This script processes audio files for transcription using OpenAI’s API, any server with the
+same API (--base-url) or a local model on the CPU (--backend local). It probes the file
+once with ffprobe (bitrate and duration) and encodes it for speech: mono, 16 kHz, Opus at
+16-24 kbps, with the bitrate chosen so a segment of the longest allowed duration fits in one
+request (25 MB). That is a fraction of the size of the usual recording formats at the same
+transcription quality, so uploads are faster; the bytes saved are reported. With
+--codec source, the original encoding is kept and only files above 25 MB with a bitrate
+above 64 kbps are transcoded to 64 kbps.
+If the audio is longer than 30 minutes (--max-duration) or still too large, it is split into segments that
+are as long as the size and duration limits allow, cut in pauses found with ffmpeg's
+silencedetect filter, so no word is cut in half. Transcoding and splitting happen in a
+single ffmpeg run that writes only the segments. Each segment is transcribed, and the resulting text is saved 
+into a .txt file next to the recording (or in --output-dir). This script ensures efficient handling 
 and transcription of large audio files, maintaining quality while adhering to size constraints.
 
+Segments are transcribed concurrently and reassembled in order. Failed requests are retried,
+and each finished segment is kept in the temporary directory, so an interrupted run of the
+same recording resumes where it stopped.
+
+Several recordings, or whole directories of them, can be given at once. Each recording gets
+its own work directory in temp_audio/, named after the hash of its audio, which also caches
+its ffprobe result and finished transcript: a rerun skips recordings that are done, even
+if they were renamed or moved. Recordings are encoded a few at a time (--encode-jobs), and
+the segments of all recordings share one queue of --concurrency transcription requests.
+
+The run ends with a summary of where the time went (hashing, probing, pause detection,
+encoding, requests), the bytes uploaded, the real-time factor (seconds of audio transcribed
+per second of wall time) and the most segments transcribed at once. --metrics writes each
+stage and segment request as a JSON line, for tuning segment length and concurrency.
+
+With --strip-silence, pauses longer than the given number of seconds are cut out before
+upload, in the same ffmpeg run, so dead air is neither uploaded nor paid for. The script
+keeps a map from the shortened audio back to the original, and with --timestamps each line
+of the transcript starts with its time in the original recording.
+
 Usage:
 ./whisper.py recording.m4a
+./whisper.py --output-dir transcripts ~/Recordings interview.mp3
+./whisper.py --concurrency 8 --retries 5 recording.m4a
+./whisper.py --max-duration 7200 lecture.mp3
+./whisper.py --strip-silence 2 --timestamps meeting.m4a
+./whisper.py --base-url http://localhost:8000/v1 --model large-v3 recording.m4a
+./whisper.py --backend local --model small recording.m4a
+./whisper.py --metrics metrics.jsonl --concurrency 8 ~/Recordings
+
+Offline benchmark of splitting and concurrency against whisper_mock_server.py:
+./whisper_mock_server.py --latency 2 &
+./whisper.py --base-url http://127.0.0.1:8000/v1 --concurrency 8 recording.m4a
 """
 
-import openai
 import os
 import argparse
+import bisect
+import contextlib
+import glob
+import hashlib
+import itertools
+import json
+import shutil
 import subprocess
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 
 # Maximum content size limit in bytes (25 MB)
 MAX_CONTENT_SIZE = 26214400
 
-# gets OPENAI_API_KEY from your environment variables
-openai = openai.OpenAI()
-
-def get_audio_bitrate(file_path):
-    # Use ffprobe to get the bitrate of the audio file in bps
-    result = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "a:0", 
-                             "-show_entries", "stream=bit_rate", 
-                             "-of", "default=noprint_wrappers=1:nokey=1", file_path],
-                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    return int(result.stdout)
-
-def transcode_to_64kbps(file_path, temp_dir):
-    # Generate a new file path for the transcoded file in the temp directory
-    base_name = os.path.basename(file_path)
-    new_file_path = os.path.join(temp_dir, base_name)
-    
-    # Transcode the file to 64 kbps using ffmpeg
-    command = ["ffmpeg", "-i", file_path, "-b:a", "64k", new_file_path]
-    subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    
-    return new_file_path
-
-def get_audio_duration(file_path):
-    # Use ffprobe to get the duration of the audio file in seconds
-    result = subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration",
-                             "-of", "default=noprint_wrappers=1:nokey=1", file_path],
-                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    return float(result.stdout)
-
-def split_audio(file_path, temp_dir):
-    # Split the audio file into 30-minute segments
+# Upload encodings: 'speech' re-encodes to SPEECH_* below, 'source' keeps the recording's
+# codec and only transcodes files larger than MAX_CONTENT_SIZE to TRANSCODE_BITRATE (bps)
+CODECS = ('speech', 'source')
+DEFAULT_CODEC = 'speech'
+TRANSCODE_BITRATE = 64000
+
+# Speech encoding: mono Opus at the model's 16 kHz sample rate, at the highest bitrate in
+# this range (bps) that still fits a segment of the longest allowed duration in one request
+SPEECH_SAMPLE_RATE = 16000
+SPEECH_MIN_BITRATE = 16000
+SPEECH_MAX_BITRATE = 24000
+
+# Longest segment sent in one request, in seconds (default of --max-duration)
+MAX_SEGMENT_DURATION = 1800
+
+# Segments are planned to use at most this share of MAX_CONTENT_SIZE (container overhead
+# and bitrate variation), and are cut in the latest pause in their last SILENCE_SEARCH_WINDOW
+PLANNED_SIZE_SHARE = 0.95
+SILENCE_SEARCH_WINDOW = 0.25
+
+# Pauses are stretches quieter than SILENCE_NOISE lasting at least SILENCE_MIN_DURATION seconds
+SILENCE_NOISE = "-35dB"
+SILENCE_MIN_DURATION = 0.5
+
+# Seconds of each removed pause that are kept at both sides, so no word onset or ending is clipped
+STRIP_SILENCE_PADDING = 0.25
+
+# ffmpeg filter script that removes pauses (in the temporary directory)
+STRIP_FILTER_FILE = "strip_silence.txt"
+
+# Number of segments transcribed at the same time
+DEFAULT_CONCURRENCY = 4
+
+# Attempts per segment after the first one, and the initial wait between them (doubled each time)
+DEFAULT_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 2
+
+# Recordings encoded (ffprobe/ffmpeg runs) at the same time
+DEFAULT_ENCODE_JOBS = 2
+
+# Work directory; every recording gets a subdirectory named after the hash of its audio
+DEFAULT_WORK_DIR = "temp_audio"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Files in a recording's work directory: its segments and their timeline (so a rerun can
+# resume), its ffprobe result, the backend, model and server of the transcribed segments, and its
+# transcript with the settings it was made with
+STATE_FILE = "segments.json"
+PROBE_FILE = "probe.json"
+TRANSCRIBER_FILE = "transcriber.json"
+TRANSCRIPT_FILE = "transcript.txt"
+DONE_FILE = "done.json"
+
+# Transcripts written by earlier runs, with their size and modification time, in the work
+# directory itself: only these may be overwritten, never other files with the same name
+WRITTEN_FILE = "written.json"
+
+# Files taken as recordings when a directory is given
+AUDIO_EXTENSIONS = ('.m4a', '.mp3', '.mp4', '.mpeg', '.mpga', '.wav', '.ogg', '.opus', '.oga',
+                    '.flac', '.webm', '.aac', '.wma', '.mov', '.mkv')
+
+class Metrics:
+    """Collects stage timings and segment requests of a run, optionally written as JSON lines."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.output = None
+        self.started = time.monotonic()
+        self.stage_seconds = {}
+        self.stage_counts = {}
+        self.audio_seconds = 0.0
+        self.segments = 0
+        self.failed_segments = 0
+        self.uploaded_bytes = 0
+        self.attempted_bytes = 0
+        self.request_seconds = 0.0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def open(self, path):
+        """Appends the events of this run to the JSON lines file `path`."""
+        self.output = open(path, 'a')
+
+    def emit(self, event, **fields):
+        with self.lock:
+            if self.output:
+                self.output.write(json.dumps({'event': event, 'time': round(time.time(), 3), **fields}) + "\n")
+                self.output.flush()
+
+    def add_stage(self, name, seconds):
+        with self.lock:
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+            self.stage_counts[name] = self.stage_counts.get(name, 0) + 1
+
+    @contextlib.contextmanager
+    def stage(self, name, recording):
+        """Times a processing stage of a recording."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            seconds = time.monotonic() - start
+            self.add_stage(name, seconds)
+            self.emit('stage', stage=name, recording=recording, seconds=round(seconds, 3))
+
+    @contextlib.contextmanager
+    def request(self):
+        """Counts a transcription request as in flight and times it (reported per segment by
+        add_segment); yields the number of requests in flight."""
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            in_flight = self.in_flight
+        start = time.monotonic()
+        try:
+            yield in_flight
+        finally:
+            self.add_stage('request', time.monotonic() - start)
+            with self.lock:
+                self.in_flight -= 1
+
+    def add_segment(self, segment, size, audio_seconds, seconds, attempts, in_flight, ok):
+        """Records a segment sent in this run. Its audio counts towards the real-time factor and
+        its bytes as uploaded only if it was transcribed; every attempt counts as attempted bytes."""
+        with self.lock:
+            self.segments += 1
+            self.failed_segments += not ok
+            self.attempted_bytes += size * attempts
+            if ok:
+                self.uploaded_bytes += size
+                self.audio_seconds += audio_seconds or 0.0
+            self.request_seconds += seconds
+        self.emit('segment', segment=segment, bytes=size, audio_seconds=audio_seconds,
+                  seconds=round(seconds, 3), attempts=attempts, in_flight=in_flight, ok=ok)
+
+    def summary(self):
+        wall = time.monotonic() - self.started
+        with self.lock:
+            return {'wall_seconds': round(wall, 3), 'audio_seconds': round(self.audio_seconds, 3),
+                    'real_time_factor': round(self.audio_seconds / wall, 2) if wall else None,
+                    'stage_seconds': {name: round(seconds, 3) for name, seconds in self.stage_seconds.items()},
+                    'stage_counts': dict(self.stage_counts), 'segments': self.segments,
+                    'failed_segments': self.failed_segments, 'uploaded_bytes': self.uploaded_bytes,
+                    'attempted_bytes': self.attempted_bytes,
+                    'request_seconds': round(self.request_seconds, 3), 'max_in_flight': self.max_in_flight}
+
+    def report(self):
+        """Prints the end-of-run summary (and writes it as the last JSON line)."""
+        summary = self.summary()
+        self.emit('summary', **summary)
+        print("\nMetrics:")
+        print(f"  Wall time: {summary['wall_seconds']:.1f} s for {summary['audio_seconds']:.0f} s of audio "
+              f"(real-time factor {summary['real_time_factor'] or 0:.1f}x)")
+        stages = ", ".join(f"{name} {seconds:.1f} s ({summary['stage_counts'][name]}x)"
+                           for name, seconds in summary['stage_seconds'].items())
+        print(f"  Stage time, summed over workers: {stages or 'none'}")
+        transcribed = summary['segments'] - summary['failed_segments']
+        if transcribed:
+            throughput = summary['uploaded_bytes'] / summary['request_seconds'] if summary['request_seconds'] else 0
+            print(f"  Uploaded: {transcribed} segment(s), {summary['uploaded_bytes'] / 1048576:.1f} MB, "
+                  f"{summary['uploaded_bytes'] / transcribed / 1048576:.2f} MB per segment, "
+                  f"{throughput / 1048576:.2f} MB/s per request")
+        if summary['attempted_bytes'] > summary['uploaded_bytes']:
+            print(f"  Sent in failed attempts: {(summary['attempted_bytes'] - summary['uploaded_bytes']) / 1048576:.1f} MB "
+                  f"({summary['failed_segments']} segment(s) failed)")
+        print(f"  Segments transcribed at once: at most {summary['max_in_flight']}")
+        if self.output:
+            self.output.close()
+            self.output = None
+
+# Stage timings and request figures of this run
+metrics = Metrics()
+
+# Transcription backends: 'openai' for OpenAI and servers with the same API (--base-url),
+# 'local' for faster-whisper on the CPU, and their default models
+BACKENDS = ('openai', 'local')
+DEFAULT_BACKEND = 'openai'
+DEFAULT_MODELS = {'openai': "whisper-1", 'local': "base"}
+
+class OpenAIBackend:
+    """OpenAI's transcription API, or a server with the same API at `base_url`.
+    
+    Gets OPENAI_API_KEY from your environment variables; servers given by `base_url` get a
+    placeholder key if none is set, as they usually do not check it.
+    """
+
+    def __init__(self, model=DEFAULT_MODELS['openai'], base_url=None):
+        import openai  # only needed for this backend
+        api_key = os.environ.get("OPENAI_API_KEY") or ("unused" if base_url else None)
+        self.client = openai.OpenAI(api_key=api_key, base_url=base_url)
+        self.model = model
+        # The server actually used (also set by OPENAI_BASE_URL), part of the cached results' settings
+        self.base_url = str(self.client.base_url)
+
+    def transcribe(self, file_path, timestamps=False):
+        with open(file_path, 'rb') as audio_file:
+            if timestamps:
+                transcript = self.client.audio.transcriptions.create(
+                    model=self.model,
+                    file=audio_file,
+                    response_format="verbose_json",
+                    timestamp_granularities=["segment"]
+                )
+                return [{'start': segment.start, 'end': segment.end, 'text': segment.text}
+                        for segment in transcript.segments]
+            transcript = self.client.audio.transcriptions.create(model=self.model, file=audio_file)
+            return transcript.text
+
+class LocalBackend:
+    """faster-whisper on the CPU (int8), with `workers` transcriptions able to run at once."""
+
+    def __init__(self, model=DEFAULT_MODELS['local'], workers=1):
+        from faster_whisper import WhisperModel  # optional, only needed for this backend
+        self.model = WhisperModel(model, device="cpu", compute_type="int8", num_workers=workers)
+        self.base_url = None
+
+    def transcribe(self, file_path, timestamps=False):
+        segments, _ = self.model.transcribe(file_path)
+        segments = [{'start': segment.start, 'end': segment.end, 'text': segment.text} for segment in segments]
+        if timestamps:
+            return segments
+        return "".join(segment['text'] for segment in segments).strip()
+
+def open_backend(backend, model=None, base_url=None, workers=1):
+    """Returns the transcription backend named `backend` (see BACKENDS)."""
+    model = model or DEFAULT_MODELS[backend]
+    if backend == 'local':
+        return LocalBackend(model, workers)
+    return OpenAIBackend(model, base_url)
+
+def probe_audio(file_path):
+    """Reads duration (seconds), bitrate (bps) and size of the audio with a single ffprobe call."""
+    with metrics.stage('probe', file_path):
+        result = subprocess.run(["ffprobe", "-v", "error", "-print_format", "json", "-show_format",
+                                 "-show_streams", "-select_streams", "a:0", file_path],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
+    info = json.loads(result.stdout)
+    stream = info['streams'][0] if info.get('streams') else {}
+    return {
+        'duration': float(stream.get('duration') or info['format']['duration']),
+        'bitrate': int(stream.get('bit_rate') or info['format'].get('bit_rate') or 0),
+        'size': os.path.getsize(file_path),
+    }
+
+def detect_silences(file_path):
+    """Returns the pauses of a recording as (start, end) tuples in seconds, via silencedetect."""
+    command = ["ffmpeg", "-hide_banner", "-nostats", "-i", file_path, "-af",
+               f"silencedetect=noise={SILENCE_NOISE}:d={SILENCE_MIN_DURATION}", "-f", "null", "-"]
+    with metrics.stage('silences', file_path):
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    silences = []
+    start = None
+    for line in result.stderr.splitlines():
+        if "silence_start:" in line:
+            start = float(line.split("silence_start:")[1].split()[0])
+        elif "silence_end:" in line and start is not None:
+            silences.append((start, float(line.split("silence_end:")[1].split()[0])))
+            start = None
+    return silences
+
+def plan_cut_points(duration, max_segment_duration, silences):
+    """Chooses cut points so every segment is at most `max_segment_duration` long and as
+    close to it as possible, cutting in the middle of the latest pause near the limit.
+    
+    Returns the cut points in seconds and how many of them had to cut outside a pause.
+    """
+    cut_points = []
+    hard_cuts = 0
+    start = 0.0
+    while duration - start > max_segment_duration:
+        limit = start + max_segment_duration
+        earliest = limit - max_segment_duration * SILENCE_SEARCH_WINDOW
+        pauses = [(silence_start + silence_end) / 2 for silence_start, silence_end in silences
+                  if earliest <= (silence_start + silence_end) / 2 <= limit]
+        if pauses:
+            cut = max(pauses)
+        else:
+            cut = limit
+            hard_cuts += 1
+        cut_points.append(cut)
+        start = cut
+    return cut_points, hard_cuts
+
+def plan_silence_removal(duration, silences, min_silence):
+    """Returns the stretches of the recording that are kept when pauses of at least
+    `min_silence` seconds are removed, as [original start, original end, start in the
+    shortened audio] lists. This is the offset map between the two timelines."""
+    kept = []
+    position = 0.0
+    shortened = 0.0
+    for start, end in silences:
+        if end - start < min_silence:
+            continue
+        cut_start, cut_end = start + STRIP_SILENCE_PADDING, end - STRIP_SILENCE_PADDING
+        kept.append([position, cut_start, shortened])
+        shortened += cut_start - position
+        position = cut_end
+    kept.append([position, duration, shortened])
+    return kept
+
+def to_original_time(seconds, kept):
+    """Maps a time in the shortened audio to the original recording."""
+    index = max(bisect.bisect_right([shortened for _, _, shortened in kept], seconds) - 1, 0)
+    original_start, _, shortened_start = kept[index]
+    return original_start + seconds - shortened_start
+
+def to_shortened_time(seconds, kept):
+    """Maps a time in the original recording to the shortened audio (a removed pause maps to where it was cut)."""
+    index = max(bisect.bisect_right([original_start for original_start, _, _ in kept], seconds) - 1, 0)
+    original_start, original_end, shortened_start = kept[index]
+    return shortened_start + min(max(seconds, original_start), original_end) - original_start
+
+def silence_filter(kept):
+    """Returns the ffmpeg filter that removes everything between the kept stretches."""
+    removed = "+".join(f"between(t,{kept[i][1]:.3f},{kept[i + 1][0]:.3f})" for i in range(len(kept) - 1))
+    return f"aselect='not({removed})',asetpts=N/SR/TB"
+
+def choose_speech_bitrate(max_segment_duration):
+    """Returns the speech bitrate (bps) at which a segment of `max_segment_duration` seconds
+    fits in one request, within SPEECH_MIN_BITRATE..SPEECH_MAX_BITRATE."""
+    fitting = MAX_CONTENT_SIZE * PLANNED_SIZE_SHARE * 8 / max_segment_duration
+    return int(max(SPEECH_MIN_BITRATE, min(SPEECH_MAX_BITRATE, fitting)) // 1000 * 1000)
+
+def encoder_settings(file_path, codec, bitrate=None):
+    """Returns the ffmpeg output options and file extension of an upload encoding.
+    
+    `codec` is 'speech' (at `bitrate`), 'transcode' (TRANSCODE_BITRATE in the source's
+    container) or 'copy' (the source's audio stream unchanged).
+    """
+    if codec == 'speech':
+        return ["-ac", "1", "-ar", str(SPEECH_SAMPLE_RATE), "-c:a", "libopus",
+                "-b:a", f"{bitrate // 1000}k", "-application", "voip"], ".ogg"
+    extension = os.path.splitext(file_path)[1] or ".m4a"
+    if codec == 'transcode':
+        return ["-b:a", f"{TRANSCODE_BITRATE // 1000}k"], extension
+    return ["-c", "copy"], extension
+
+def encode_segments(file_path, temp_dir, cut_points, encoding, audio_filter=None):
+    """Encodes the audio with `encoding` (see encoder_settings), applying `audio_filter` if
+    given, and splits it at `cut_points` (seconds of the output) in one ffmpeg run.
+    
+    Only the segments are written, never a full-length intermediate file.
+    """
+    options, extension = encoding
+    command = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-i", file_path,
+               "-map", "0:a:0", "-vn", *options]
+    if audio_filter:
+        # Read from a file: one term per removed pause can exceed the command line length limit
+        filter_path = os.path.join(temp_dir, STRIP_FILTER_FILE)
+        with open(filter_path, 'w') as f:
+            f.write(audio_filter)
+        command += ["-filter_script:a", filter_path]
+    if cut_points:
+        command += ["-f", "segment", "-segment_times", ",".join(f"{cut:.3f}" for cut in cut_points),
+                    "-reset_timestamps", "1", os.path.join(temp_dir, f"output_audio_%03d{extension}")]
+    else:
+        command += [os.path.join(temp_dir, f"output_audio_000{extension}")]
+    with metrics.stage('encode', file_path):
+        subprocess.run(command, check=True)
+    
     segment_files = []
-    command = ["ffmpeg", "-i", file_path, "-f", "segment", "-segment_time", "1800", "-c", 
-                "copy", os.path.join(temp_dir, "output_audio_%03d.m4a")]    
-    subprocess.run(command)
     for file in sorted(os.listdir(temp_dir)):
-        if file.startswith("output_audio_") and file.endswith(".m4a"):
+        if file.startswith("output_audio_") and file.endswith(extension):
             segment_files.append(os.path.join(temp_dir, file))
     return segment_files
 
-def transcribe_audio(file_path):
+def report_savings(source_size, segment_files):
+    """Prints how many bytes the encoded segments save compared to uploading the source."""
+    upload_size = sum(os.path.getsize(segment) for segment in segment_files)
+    saved = source_size - upload_size
+    print(f"Uploading {upload_size / 1048576:.1f} MB instead of {source_size / 1048576:.1f} MB "
+          f"({abs(saved) / 1048576:.1f} MB, {abs(saved) / source_size:.0%} {'saved' if saved >= 0 else 'more'}).")
+
+def choose_encoding(file_path, probe, codec, max_segment_duration, reencode=False):
+    """Returns the upload encoding (see encoder_settings) and its bytes per second. The
+    encoding is None if the audio can be uploaded as it is, unless `reencode` is set."""
+    if codec == 'speech':
+        bitrate = choose_speech_bitrate(max_segment_duration)
+        # A recording already below the speech bitrate would only lose quality by re-encoding
+        if reencode or not 0 < probe['bitrate'] <= bitrate:
+            print(f"Encoding for speech: mono, {SPEECH_SAMPLE_RATE // 1000} kHz, Opus at {bitrate // 1000} kbps...")
+            return encoder_settings(file_path, 'speech', bitrate), bitrate / 8
+    elif reencode or (probe['size'] > MAX_CONTENT_SIZE and probe['bitrate'] > TRANSCODE_BITRATE):
+        print(f"Transcoding the file to {TRANSCODE_BITRATE // 1000} kbps...")
+        return encoder_settings(file_path, 'transcode'), TRANSCODE_BITRATE / 8
+    return None, probe['size'] / probe['duration']
+
+def prepare_segments(file_path, temp_dir, codec=DEFAULT_CODEC, max_segment_duration=MAX_SEGMENT_DURATION,
+                     strip_silence=None, probe=None):
+    """Returns the files to upload and their timeline. The files are the recording itself if
+    it fits in one request and needs no encoding, else segments in the upload encoding, cut in
+    pauses near the size and duration limits. Pauses of at least `strip_silence` seconds are
+    removed first, if given. `probe` is the result of probe_audio, if known.
+    
+    The timeline holds where each segment starts in the (shortened) audio, the length of that
+    audio and, if pauses were removed, the offset map from plan_silence_removal (else None).
+    """
+    probe = probe or probe_audio(file_path)
+    duration = probe['duration']
+    silences = None
+    kept = None
+    if strip_silence:
+        print(f"Looking for pauses longer than {strip_silence:g} s to remove...")
+        silences = detect_silences(file_path)
+        kept = plan_silence_removal(duration, silences, strip_silence)
+        if len(kept) > 1:
+            duration = kept[-1][2] + kept[-1][1] - kept[-1][0]
+            removed = probe['duration'] - duration
+            print(f"Removing {len(kept) - 1} pause(s): {removed:.0f} s of {probe['duration']:.0f} s "
+                  f"({removed / probe['duration']:.0%}).")
+        else:
+            kept = None
+    encoding, bytes_per_second = choose_encoding(file_path, probe, codec, max_segment_duration, reencode=kept is not None)
+    timeline = {'segment_starts': [0.0], 'kept': kept, 'duration': duration}
+    
+    # Longest segment that stays within the duration and the upload size limit
+    max_duration = min(max_segment_duration, MAX_CONTENT_SIZE * PLANNED_SIZE_SHARE / bytes_per_second)
+    if duration <= max_duration and encoding is None:
+        return [file_path], timeline
+    
+    cut_points = []
+    if duration > max_duration:
+        if silences is None:
+            # Analysis pass only: decodes the audio, but writes nothing
+            print(f"Looking for pauses to split the audio into segments of up to {max_duration:.0f} s...")
+            silences = detect_silences(file_path)
+        if kept:
+            silences = [(to_shortened_time(start, kept), to_shortened_time(end, kept)) for start, end in silences]
+        cut_points, hard_cuts = plan_cut_points(duration, max_duration, silences)
+        print(f"Splitting audio into {len(cut_points) + 1} segments "
+              f"({len(cut_points) - hard_cuts} cut in pauses, {hard_cuts} without a pause nearby)...")
+    segment_files = encode_segments(file_path, temp_dir, cut_points, encoding or encoder_settings(file_path, 'copy'),
+                                    silence_filter(kept) if kept else None)
+    if encoding:
+        report_savings(probe['size'], segment_files)
+    timeline['segment_starts'] += cut_points
+    return segment_files, timeline
+
+def transcribe_audio(backend, file_path, timestamps=False):
+    """Returns the text of an audio file, or with `timestamps` its segments as
+    {'start', 'end', 'text'} dicts (seconds from the start of the file). None on error."""
     
     # Ensure the file exists
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"The file {file_path} does not exist")
 
     try:
-        # Open the file in binary mode
-        with open(file_path, 'rb') as audio_file:
-            
-            # Send the file to OpenAI for transcription
-            transcript = openai.audio.transcriptions.create(
-                model="whisper-1",  # Specify the Whisper model
-                file=audio_file
-            )
-            return transcript.text
+        return backend.transcribe(file_path, timestamps)
 
     except Exception as e:
         print(f"An error occurred: {e}")
         return None
 
+def audio_hash(file_path):
+    """Returns a short SHA-256 hex digest of a recording's content."""
+    digest = hashlib.sha256()
+    with metrics.stage('hash', file_path), open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+def cached_probe(work_dir, file_path):
+    """Returns probe_audio's result for the recording, from the work directory if known."""
+    probe_path = os.path.join(work_dir, PROBE_FILE)
+    try:
+        with open(probe_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    probe = probe_audio(file_path)
+    with open(probe_path, 'w') as f:
+        json.dump(probe, f)
+    return probe
+
+def load_segments(temp_dir, settings):
+    """Returns the segments and timeline of a previous run with the same settings, or (None, None)."""
+    try:
+        with open(os.path.join(temp_dir, STATE_FILE), 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None, None
+    if state.get('settings') != settings:
+        return None, None
+    if not all(os.path.exists(segment) for segment in state['segments']):
+        return None, None
+    return state['segments'], state['timeline']
+
+def save_segments(temp_dir, file_path, settings, segment_files, timeline):
+    with open(os.path.join(temp_dir, STATE_FILE), 'w') as f:
+        json.dump({'source': os.path.abspath(file_path), 'settings': settings, 'segments': segment_files,
+                   'timeline': timeline}, f)
+
+def clear_work_files(temp_dir):
+    """Removes segments, partial transcripts and results made with other settings."""
+    for pattern in ("output_audio_*", "transcript_*.json", STRIP_FILTER_FILE, STATE_FILE, TRANSCRIBER_FILE,
+                    TRANSCRIPT_FILE, DONE_FILE):
+        for path in glob.glob(os.path.join(temp_dir, pattern)):
+            os.remove(path)
+
+def keep_transcripts_of(temp_dir, transcriber):
+    """Removes transcribed segments made with another backend, model or server, keeping the
+    encoded segments, so they are sent again to `transcriber` (a dict of backend, model and
+    base_url)."""
+    transcriber_path = os.path.join(temp_dir, TRANSCRIBER_FILE)
+    try:
+        with open(transcriber_path, 'r') as f:
+            if json.load(f) == transcriber:
+                return
+    except (OSError, ValueError):
+        pass
+    for pattern in ("transcript_*.json", TRANSCRIPT_FILE, DONE_FILE):
+        for path in glob.glob(os.path.join(temp_dir, pattern)):
+            os.remove(path)
+    with open(transcriber_path, 'w') as f:
+        json.dump(transcriber, f)
+
+def transcribe_segment(backend, segment, transcript_part, retries=DEFAULT_RETRIES, timestamps=False,
+                       audio_seconds=None):
+    """Transcribes one segment, retrying failed requests with exponential backoff.
+    
+    The result (see transcribe_audio) is kept in `transcript_part` as JSON; if that file
+    exists, the segment was finished by an earlier run and is not sent again. Returns None
+    if every attempt failed. The requests are recorded in the metrics, with the segment's
+    `audio_seconds` if known.
+    """
+    if os.path.exists(transcript_part):
+        with open(transcript_part, 'r') as f:
+            print(f"Segment {segment} already transcribed.")
+            return json.load(f)
+    
+    size = os.path.getsize(segment)
+    request_seconds = 0.0
+    in_flight = 0
+    transcription = None
+    delay = RETRY_BACKOFF_SECONDS
+    for attempt in range(retries + 1):
+        if attempt:
+            print(f"Retrying {segment} in {delay} s (attempt {attempt + 1}/{retries + 1})...")
+            time.sleep(delay)
+            delay *= 2
+        print(f"Transcribing {segment}...")
+        start = time.monotonic()
+        with metrics.request() as running:
+            in_flight = max(in_flight, running)
+            transcription = transcribe_audio(backend, segment, timestamps)
+        request_seconds += time.monotonic() - start
+        if transcription is not None:
+            # Write under a temporary name first, so a crash never leaves a partial file
+            with open(transcript_part + ".tmp", 'w') as f:
+                json.dump(transcription, f)
+            os.replace(transcript_part + ".tmp", transcript_part)
+            print(f"Segment {segment} transcribed successfully.")
+            break
+    metrics.add_segment(segment, size, audio_seconds, request_seconds, attempt + 1, in_flight,
+                        transcription is not None)
+    return transcription
+
+def segment_durations(timeline):
+    """Returns how many seconds of the original recording each segment covers (removed pauses
+    included), or None per segment if the timeline does not record the length."""
+    starts = timeline['segment_starts']
+    if timeline.get('duration') is None:
+        return [None] * len(starts)
+    ends = starts[1:] + [timeline['duration']]
+    if timeline['kept']:
+        starts = [to_original_time(start, timeline['kept']) for start in starts]
+        ends = [to_original_time(end, timeline['kept']) for end in ends]
+    return [round(end - start, 3) for start, end in zip(starts, ends)]
+
+def submit_segments(request_pool, backend, segment_files, temp_dir, retries=DEFAULT_RETRIES, timestamps=False,
+                    durations=None):
+    """Queues the segments on the shared request pool; returns their futures in segment order."""
+    durations = durations or [None] * len(segment_files)
+    return [request_pool.submit(transcribe_segment, backend, segment,
+                                os.path.join(temp_dir, f"transcript_{index:03d}.json"), retries, timestamps,
+                                duration)
+            for index, (segment, duration) in enumerate(zip(segment_files, durations))]
+
+def format_timestamp(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+def transcript_lines(transcriptions, timeline):
+    """Yields the lines of the transcript in order. Timestamped results are moved from segment
+    time to the time in the original recording (undoing removed pauses)."""
+    for segment_start, transcription in zip(timeline['segment_starts'], transcriptions):
+        if not transcription:
+            continue
+        if isinstance(transcription, str):
+            yield transcription
+            continue
+        for part in transcription:
+            seconds = segment_start + part['start']
+            if timeline['kept']:
+                seconds = to_original_time(seconds, timeline['kept'])
+            yield f"[{format_timestamp(seconds)}] {part['text'].strip()}"
+
+def find_recordings(paths, work_root=None):
+    """Returns the given recordings, with directories replaced by the audio files in them (recursively).
+    
+    The work directory `work_root` is skipped, so its encoded segments are never taken for recordings.
+    """
+    work_root = os.path.abspath(work_root) if work_root else None
+    recordings = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs[:] = [name for name in dirs if os.path.abspath(os.path.join(root, name)) != work_root]
+                recordings.extend(os.path.join(root, file) for file in sorted(files)
+                                  if file.lower().endswith(AUDIO_EXTENSIONS) and not file.startswith("."))
+        else:
+            recordings.append(path)
+    # A recording given twice would be prepared twice in the same work directory at once
+    unique = {}
+    for recording in recordings:
+        unique.setdefault(os.path.abspath(recording), recording)
+    return list(unique.values())
+
+def load_written(work_root):
+    """Returns the transcripts written by earlier runs (absolute path -> [size, mtime_ns])."""
+    try:
+        with open(os.path.join(work_root, WRITTEN_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def record_written(work_root, written, target_path):
+    """Adds a transcript just written to `written` and saves it in the work directory."""
+    stat = os.stat(target_path)
+    written[os.path.abspath(target_path)] = [stat.st_size, stat.st_mtime_ns]
+    written_path = os.path.join(work_root, WRITTEN_FILE)
+    with open(written_path + ".tmp", 'w') as f:
+        json.dump(written, f)
+    os.replace(written_path + ".tmp", written_path)
+
+def is_free(path, written):
+    """True if nothing is at `path`, or a transcript that this script wrote and nobody changed since."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return True
+    return written.get(path) == [stat.st_size, stat.st_mtime_ns]
+
+def output_paths(recordings, output_dir=None, written=None):
+    """Returns where the transcript of each recording is written: <name>.txt next to it or in
+    `output_dir`. Recordings that would share a transcript name (rec.m4a and rec.mp3, or
+    a/rec.mp3 and b/rec.mp3 in one output directory), or whose name is taken by a file this
+    script did not write (see `written`, from load_written), get <name>.<ext>.txt or a number instead."""
+    written = written or {}
+    paths = []
+    taken = set()
+    for file_path in recordings:
+        directory = output_dir or os.path.dirname(os.path.abspath(file_path))
+        base_name = os.path.basename(file_path)
+        stem = os.path.splitext(base_name)[0]
+        candidates = itertools.chain([f"{stem}.txt", f"{base_name}.txt"],
+                                     (f"{stem}_{number}.txt" for number in itertools.count(2)))
+        for name in candidates:
+            path = os.path.abspath(os.path.join(directory, name))
+            if path not in taken and is_free(path, written):
+                break
+        if name != f"{stem}.txt":
+            print(f"Warning: {os.path.join(directory, stem + '.txt')} is taken by another transcript or file, "
+                  f"writing the transcript of {file_path} to {name} instead.")
+        taken.add(path)
+        paths.append(os.path.join(directory, name))
+    return paths
+
+def start_recording(file_path, work_root, settings, request_pool, backend, retries, claimed):
+    """Runs in the encode pool: finds the recording's work directory, returns its cached
+    transcript if it is done, else prepares (or resumes) its segments and queues them.
+    
+    Returns a job dict with the work directory and either 'cached' or the segments' 'futures'.
+    Recordings with the same audio share one job; `claimed` maps work directories to them.
+    """
+    work_dir = os.path.join(work_root, audio_hash(file_path))
+    claim = Future()
+    # dict.setdefault is atomic, so only one job prepares each work directory
+    first = claimed.setdefault(work_dir, claim)
+    if first is not claim:
+        return dict(first.result(), file_path=file_path)
+    try:
+        job = prepare_recording(file_path, work_dir, settings, request_pool, backend, retries)
+    except Exception as e:
+        claim.set_exception(e)
+        raise
+    claim.set_result(job)
+    return job
+
+def prepare_recording(file_path, work_dir, settings, request_pool, backend, retries):
+    os.makedirs(work_dir, exist_ok=True)
+    job = {'file_path': file_path, 'work_dir': work_dir}
+    try:
+        with open(os.path.join(work_dir, DONE_FILE), 'r') as f:
+            if json.load(f) == settings and os.path.exists(os.path.join(work_dir, TRANSCRIPT_FILE)):
+                job['cached'] = True
+                return job
+    except (OSError, ValueError):
+        pass
+    
+    # Transcription settings (backend, model, server) do not change the segments
+    segment_settings = {key: settings[key] for key in ('codec', 'max_duration', 'strip_silence', 'timestamps')}
+    segment_files, timeline = load_segments(work_dir, segment_settings)
+    probe = cached_probe(work_dir, file_path)
+    if segment_files is not None:
+        print(f"Resuming {file_path}: {len(segment_files)} segment(s) already prepared.")
+    else:
+        clear_work_files(work_dir)
+        print(f"Preparing {file_path}...")
+        segment_files, timeline = prepare_segments(file_path, work_dir, settings['codec'], settings['max_duration'],
+                                                   settings['strip_silence'], probe)
+        save_segments(work_dir, file_path, segment_settings, segment_files, timeline)
+    keep_transcripts_of(work_dir, {key: settings[key] for key in ('backend', 'model', 'base_url')})
+    job.update(segments=segment_files, timeline=timeline,
+               futures=submit_segments(request_pool, backend, segment_files, work_dir, retries, settings['timestamps'],
+                                       segment_durations(timeline)))
+    return job
+
+def finish_recording(job, settings, target_path):
+    """Waits for a recording's segments and writes its transcript. Returns False if segments failed."""
+    file_path, work_dir = job['file_path'], job['work_dir']
+    transcript_path = os.path.join(work_dir, TRANSCRIPT_FILE)
+    if not job.get('cached'):
+        transcriptions = [future.result() for future in job['futures']]
+        failed = [segment for segment, transcription in zip(job['segments'], transcriptions) if transcription is None]
+        if failed:
+            print(f"{file_path}: {len(failed)} segment(s) could not be transcribed: {', '.join(failed)}")
+            return False
+        with open(transcript_path, 'w') as transcript_file:
+            for line in transcript_lines(transcriptions, job['timeline']):
+                transcript_file.write(line + "\n")
+        with open(os.path.join(work_dir, DONE_FILE), 'w') as f:
+            json.dump(settings, f)
+    else:
+        print(f"{file_path} was transcribed before with the same settings.")
+    
+    shutil.copyfile(transcript_path, target_path)
+    print(f"Transcript written to {target_path}")
+    return True
+
+def transcribe_recordings(recordings, settings, backend, work_root=DEFAULT_WORK_DIR, output_dir=None,
+                          concurrency=DEFAULT_CONCURRENCY, encode_jobs=DEFAULT_ENCODE_JOBS, retries=DEFAULT_RETRIES):
+    """Transcribes recordings: `encode_jobs` are prepared at a time, and the segments of all of
+    them share one pool of `concurrency` requests, so uploads start while later recordings
+    are still being encoded. Returns the number of transcribed, cached and failed recordings."""
+    done = cached = failed = 0
+    claimed = {}
+    written = load_written(work_root)
+    targets = output_paths(recordings, output_dir, written)
+    with ThreadPoolExecutor(max_workers=concurrency) as request_pool, \
+         ThreadPoolExecutor(max_workers=encode_jobs) as encode_pool:
+        jobs = [encode_pool.submit(start_recording, file_path, work_root, settings, request_pool, backend, retries,
+                                    claimed)
+                for file_path in recordings]
+        for file_path, job, target_path in zip(recordings, jobs, targets):
+            try:
+                job = job.result()
+                if not finish_recording(job, settings, target_path):
+                    failed += 1
+                    continue
+                record_written(work_root, written, target_path)
+                if job.get('cached'):
+                    cached += 1
+                else:
+                    done += 1
+            except Exception as e:
+                print(f"Could not transcribe {file_path}: {e}")
+                failed += 1
+    return done, cached, failed
+
 if __name__ == "__main__":
 
     # Set up argument parsing
     parser = argparse.ArgumentParser(description=
-        "Transcribe a voice recording using OpenAI's API.")
-    parser.add_argument("file_path", help="Path to the voice file")
+        "Transcribe voice recordings using OpenAI's API, a compatible server or a local model.")
+    parser.add_argument("paths", nargs='+', help="Voice files, or directories of them (searched recursively)")
+    parser.add_argument("--output-dir", help="Directory for the transcripts (default: next to each recording)")
+    parser.add_argument("--work-dir", default=DEFAULT_WORK_DIR,
+                        help=f"Directory for segments and cached results (default: {DEFAULT_WORK_DIR})")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Number of segments transcribed at the same time, across all recordings "
+                             f"(default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--encode-jobs", type=int, default=DEFAULT_ENCODE_JOBS,
+                        help=f"Number of recordings encoded at the same time (default: {DEFAULT_ENCODE_JOBS})")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help=f"Retries per segment after a failed request (default: {DEFAULT_RETRIES})")
+    parser.add_argument("--codec", choices=CODECS, default=DEFAULT_CODEC,
+                        help="Upload encoding: 'speech' (mono 16 kHz Opus, smallest) or 'source' "
+                             f"(keep the recording's codec) (default: {DEFAULT_CODEC})")
+    parser.add_argument("--max-duration", type=float, default=MAX_SEGMENT_DURATION,
+                        help=f"Longest segment sent in one request, in seconds (default: {MAX_SEGMENT_DURATION})")
+    parser.add_argument("--backend", choices=BACKENDS, default=DEFAULT_BACKEND,
+                        help=f"'openai' (OpenAI or a compatible server) or 'local' (faster-whisper on the CPU) "
+                             f"(default: {DEFAULT_BACKEND})")
+    parser.add_argument("--base-url", help="URL of an OpenAI-compatible server, e.g. http://localhost:8000/v1 "
+                                           "(default: OpenAI, or OPENAI_BASE_URL)")
+    parser.add_argument("--model", help="Transcription model (default: "
+                                         + ", ".join(f"{model} for {name}" for name, model in DEFAULT_MODELS.items()) + ")")
+    parser.add_argument("--strip-silence", type=float, metavar="SECONDS",
+                        help="Remove pauses of at least SECONDS before upload (e.g. 2)")
+    parser.add_argument("--timestamps", action="store_true",
+                        help="Start each transcript line with its time in the original recording")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="Append stage timings and segment requests to FILE as JSON lines")
 
     args = parser.parse_args()
-    temp_dir = "temp_audio"
-    os.makedirs(temp_dir, exist_ok=True)
-    
-    # Check the file size
-    file_size = os.path.getsize(args.file_path)
-    if file_size > MAX_CONTENT_SIZE:
-        # Check the bitrate
-        bitrate = get_audio_bitrate(args.file_path)
-        if bitrate > 64000:
-            print(f"Bitrate ({bitrate} bps) is greater than 64 kbps. Transcoding the file...")
-            args.file_path = transcode_to_64kbps(args.file_path, temp_dir)
-
-    # Check the duration of the audio file
-    duration = get_audio_duration(args.file_path)
-
-    # If the audio is longer than 30 minutes, split it
-    if duration > 1800:
-        print("Splitting audio into 30-minute segments...")
-        segment_files = split_audio(args.file_path)
-    else:
-        segment_files = [args.file_path]
-
-    # Transcribe each segment and write to text file
-    transcript_path = os.path.join(temp_dir, "transcript.txt")
-    with open(transcript_path, 'w') as transcript_file:
-        for segment in segment_files:
-            print(f"Transcribing {segment}...")
-            transcription = transcribe_audio(segment)
-            if transcription:
-                transcript_file.write(transcription + "\n")
-                print(f"Segment {segment} transcribed successfully.")
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.max_duration <= 0:
+        parser.error("--max-duration must be positive")
+    if args.strip_silence is not None and args.strip_silence < SILENCE_MIN_DURATION:
+        parser.error(f"--strip-silence must be at least {SILENCE_MIN_DURATION} seconds")
+    if args.encode_jobs < 1:
+        parser.error("--encode-jobs must be at least 1")
+    if args.retries < 0:
+        parser.error("--retries must be at least 0")
+    recordings = find_recordings(args.paths, args.work_dir)
+    if not recordings:
+        parser.error("no recordings found")
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    os.makedirs(args.work_dir, exist_ok=True)
+    
+    if args.metrics:
+        metrics.open(args.metrics)
+    backend = open_backend(args.backend, args.model, args.base_url, workers=args.concurrency)
+    settings = {'codec': args.codec, 'max_duration': args.max_duration, 'strip_silence': args.strip_silence,
+                'timestamps': args.timestamps, 'backend': args.backend,
+                'model': args.model or DEFAULT_MODELS[args.backend], 'base_url': backend.base_url}
+    done, cached, failed = transcribe_recordings(recordings, settings, backend, args.work_dir, args.output_dir,
+                                                 args.concurrency, args.encode_jobs, args.retries)
+    
+    metrics.report()
+    print(f"\nTranscribed {done}, already done {cached}, failed {failed} of {len(recordings)} recording(s).")
+    if failed:
+        print("Run the same command again to retry only the missing segments.")
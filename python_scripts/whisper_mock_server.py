@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+Mock Transcription Server
+
+This script serves an OpenAI-compatible transcription endpoint (POST .../audio/transcriptions)
+that returns deterministic text instead of transcribing, after a configurable delay. It lets
+whisper.py's splitting, concurrency and retry handling be run and benchmarked offline,
+without an API key, network or cost.
+
+Features:
+- The text depends only on the uploaded audio (size and SHA-256), so reruns are comparable
+- Answers plain JSON and verbose_json (with one timestamped segment per 30 s of audio,
+  estimated from the upload size)
+- Latency: a fixed delay per request plus a delay per MB uploaded
+- Optional failures (every Nth request answers HTTP 500) to exercise retries
+- Handles requests concurrently and logs how many were in flight
+
+Usage:
+    ./whisper_mock_server.py
+    ./whisper_mock_server.py --port 8001 --latency 2 --latency-per-mb 0.5 --fail-every 10
+
+    Then point whisper.py at it:
+    ./whisper.py --base-url http://127.0.0.1:8000/v1 --concurrency 8 recording.m4a
+"""
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+
+# Default delay per request (seconds) and per MB uploaded (seconds)
+DEFAULT_LATENCY = 1.0
+DEFAULT_LATENCY_PER_MB = 0.0
+
+# Assumed upload bitrate (bps) for estimating the audio duration (speech encoding of whisper.py),
+# and the length of the segments returned with verbose_json
+ASSUMED_BITRATE = 24000
+SEGMENT_SECONDS = 30
+
+def parse_form(content_type, body):
+    """Returns the fields of a multipart/form-data body as a dict of name -> bytes."""
+    message = BytesParser().parsebytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+    fields = {}
+    if message.is_multipart():
+        for part in message.get_payload():
+            name = part.get_param('name', header='content-disposition')
+            if name:
+                fields[name] = part.get_payload(decode=True)
+    return fields
+
+def mock_transcription(audio, verbose):
+    """Returns the deterministic response for an uploaded audio file."""
+    digest = hashlib.sha256(audio).hexdigest()[:12]
+    duration = len(audio) * 8 / ASSUMED_BITRATE
+    segments = []
+    start = 0.0
+    while start < duration or not segments:
+        end = min(start + SEGMENT_SECONDS, duration)
+        segments.append({'id': len(segments), 'seek': 0, 'start': start, 'end': end,
+                         'text': f" Segment {len(segments) + 1} of audio {digest}.",
+                         'tokens': [], 'temperature': 0.0, 'avg_logprob': 0.0,
+                         'compression_ratio': 1.0, 'no_speech_prob': 0.0})
+        start = end
+    text = f"Mock transcript of {len(audio)} bytes of audio {digest}."
+    if verbose:
+        return {'task': "transcribe", 'language': "english", 'duration': duration,
+                'text': text, 'segments': segments}
+    return {'text': text}
+
+class MockHandler(BaseHTTPRequestHandler):
+    # Set by main()
+    latency = DEFAULT_LATENCY
+    latency_per_mb = DEFAULT_LATENCY_PER_MB
+    fail_every = 0
+
+    lock = threading.Lock()
+    requests = 0
+    in_flight = 0
+    max_in_flight = 0
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith("/audio/transcriptions"):
+            self.send_json(404, {'error': {'message': f"unknown path {self.path}"}})
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        fields = parse_form(self.headers.get('Content-Type', ""), body)
+        audio = fields.get('file')
+        if audio is None:
+            self.send_json(400, {'error': {'message': "no file uploaded"}})
+            return
+
+        cls = type(self)
+        with cls.lock:
+            cls.requests += 1
+            number = cls.requests
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+            in_flight = cls.in_flight
+        print(f"Request {number}: {len(audio) / 1048576:.2f} MB, {in_flight} in flight")
+        try:
+            time.sleep(cls.latency + cls.latency_per_mb * len(audio) / 1048576)
+            if cls.fail_every and number % cls.fail_every == 0:
+                self.send_json(500, {'error': {'message': "mock failure"}})
+                return
+            verbose = fields.get('response_format', b"json").decode() == "verbose_json"
+            self.send_json(200, mock_transcription(audio, verbose))
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', "application/json")
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock OpenAI-compatible transcription server for offline tests')
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f'Address to listen on (default: {DEFAULT_HOST})')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'Port to listen on (default: {DEFAULT_PORT})')
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY,
+                        help=f'Delay per request in seconds (default: {DEFAULT_LATENCY})')
+    parser.add_argument('--latency-per-mb', type=float, default=DEFAULT_LATENCY_PER_MB,
+                        help=f'Additional delay per MB uploaded in seconds (default: {DEFAULT_LATENCY_PER_MB})')
+    parser.add_argument('--fail-every', type=int, default=0,
+                        help='Answer every Nth request with HTTP 500 (default: 0, never)')
+    args = parser.parse_args()
+
+    MockHandler.latency = args.latency
+    MockHandler.latency_per_mb = args.latency_per_mb
+    MockHandler.fail_every = args.fail_every
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    print(f"Mock transcription server on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"\n{MockHandler.requests} request(s), at most {MockHandler.max_in_flight} at once")
+
+if __name__ == "__main__":
+    main()